@@ -1,12 +1,17 @@
 import os
 import json
+import base64
+from argparse import ArgumentParser
 from dotenv import load_dotenv
+from sessionClient import SessionClient
+from distanceCache import DistanceCache
+from teamSync import TeamSync, from_bitset
+from lookahead import LookaheadPlanner
+from endgame import EndgameSolver
 
+import numpy as np
 import paho.mqtt.client as paho
-from paho import mqtt
 import time
-from sys import argv
-from keyboard import read_event
 from random import choice
 from math import sqrt
 
@@ -14,32 +19,59 @@ CURSOR_UP_ONE = "\x1b[1A"
 ERASE_LINE = "\x1b[2K"
 
 
+Coord = tuple[int, int]
+
+
+# Per cell score terms indexed by map value + 1, plus 5 for cells not seen yet
+SCALE = np.array([1, 1, 1, 1 / 2, 1 / 3] * 2, dtype=np.float32)
+OFFSET = np.array(
+    [np.inf, np.inf, 1, 1 / 2, 1 / 3, np.inf, 201, 1, 1 / 2, 1 / 3], dtype=np.float32
+)
+
+
 class PlayerMap:
-    def __init__(self, observer, player_name: str, rows: int, columns: int) -> None:
+    def __init__(
+        self,
+        observer,
+        player_name: str,
+        rows: int,
+        columns: int,
+        enemy_penalty: float = 0,
+        enemy_radius: int = 2,
+    ) -> None:
+        """
+        :param enemy_penalty: added to the score of a target next to a known enemy,
+        scaled down linearly to 0 at enemy_radius + 1 steps away
+        """
         self.initializing = True
         self.observer = observer
         self.player_name: str = player_name
         self.rows = rows
         self.columns = columns
-        self.seen_coords: list[list[int]] = []
-        self.current_position: list[int] = None
-        self.teammates: list[list[int]] = []
-        self.teammate_names: list[str] = []
-        self.enemies: list[list[int]] = []
-        self.walls: list[list[int]] = []
-        self.coin1: list[list[int]] = []
-        self.coin2: list[list[int]] = []
-        self.coin3: list[list[int]] = []
+        # Knowledge is kept in sets of (x, y) so lookups and removals do not scan
+        self.seen_coords: set[Coord] = set()
+        self.observed: set[Coord] = set()  # cells that were in our own vision, not only a teammate's
+        self.unseen = np.ones((rows, columns), dtype=bool)
+        self.current_position: Coord = None
+        self.teammates: dict[str, Coord] = {}  # {'player_name' : (x, y)}
+        self.enemies: set[Coord] = set()
+        self.team_enemies: set[Coord] = set()  # enemies in the team's vision, see load_team_state
+        self.walls: set[Coord] = set()
+        self.coin1: set[Coord] = set()
+        self.coin2: set[Coord] = set()
+        self.coin3: set[Coord] = set()
         self.score = 0
         for i in range(columns + 2):
-            self.walls.append([-1, i])
-            self.walls.append([rows, i])
+            self.walls.add((-1, i))
+            self.walls.add((rows, i))
         for i in range(rows + 2):
-            self.walls.append([i, -1])
-            self.walls.append([i, columns])
-        self.map: list[list[int]] = [
-            [0 for i in range(self.rows)] for j in range(self.columns)
-        ]
+            self.walls.add((i, -1))
+            self.walls.add((i, columns))
+        # -1 blocked, 1 to 3 coin value, 0 anything else
+        self.map = np.zeros((rows, columns), dtype=np.int8)
+        self.distances = DistanceCache(rows, columns)
+        self.enemy_penalty = enemy_penalty
+        self.enemy_radius = enemy_radius
 
     def print_map(self):
         display_map: list[list[str]] = [
@@ -48,8 +80,8 @@ class PlayerMap:
         display_map[self.current_position[0]][
             self.current_position[1]
         ] = self.player_name
-        for i, teammate in enumerate(self.teammates):
-            display_map[teammate[0]][teammate[1]] = self.teammate_names[i]
+        for name, teammate in self.teammates.items():
+            display_map[teammate[0]][teammate[1]] = name
         for enemy in self.enemies:
             display_map[enemy[0]][enemy[1]] = "Enemy"
         for wall in self.walls:
@@ -77,227 +109,225 @@ class PlayerMap:
         print(output)
         self.initializing = False
 
+    def visible_coords(self, center: Coord = None):
+        # Cells within the 5x5 vision square around the player, or around center
+        x, y = self.current_position if center is None else center
+        for i in range(max(x - 2, 0), min(x + 3, self.rows)):
+            for j in range(max(y - 2, 0), min(y + 3, self.columns)):
+                yield i, j
+
     def remove_collected_coins(self, game_state: dict):
         coins = [[], [], []]
-        if self.current_position in self.coin1:
-            self.coin1.remove(self.current_position)
-            coins[0].append(self.current_position)
-        if self.current_position in self.coin2:
-            self.coin2.remove(self.current_position)
-            coins[1].append(self.current_position)
-        if self.current_position in self.coin3:
-            self.coin3.remove(self.current_position)
-            coins[2].append(self.current_position)
-        for enemy in self.enemies:
-            if enemy in self.coin1:
-                self.coin1.remove(enemy)
-                coins[0].append(enemy)
-            if enemy in self.coin2:
-                self.coin2.remove(enemy)
-                coins[1].append(enemy)
-            if enemy in self.coin3:
-                self.coin3.remove(enemy)
-                coins[2].append(enemy)
-
-        for coin in self.coin1:
-            if (
-                coin[0] < self.current_position[0] - 2
-                or coin[0] > self.current_position[0] + 2
-            ):
-                continue
-            if (
-                coin[1] < self.current_position[1] - 2
-                or coin[1] > self.current_position[1] + 2
-            ):
-                continue
-            if coin not in game_state["coin1"]:
-                self.coin1.remove(coin)
-                coins[0].append(coin)
-        for coin in self.coin2:
-            if (
-                coin[0] < self.current_position[0] - 2
-                or coin[0] > self.current_position[0] + 2
-            ):
-                continue
-            if (
-                coin[1] < self.current_position[1] - 2
-                or coin[1] > self.current_position[1] + 2
-            ):
-                continue
-            if coin not in game_state["coin2"]:
-                self.coin2.remove(coin)
-                coins[1].append(coin)
-        for coin in self.coin3:
-            if (
-                coin[0] < self.current_position[0] - 2
-                or coin[0] > self.current_position[0] + 2
-            ):
-                continue
-            if (
-                coin[1] < self.current_position[1] - 2
-                or coin[1] > self.current_position[1] + 2
-            ):
-                continue
-            if coin not in game_state["coin3"]:
-                self.coin3.remove(coin)
-                coins[2].append(coin)
+        stores = (self.coin1, self.coin2, self.coin3)
+        # Coins under a player are gone
+        for coord in [self.current_position, *self.enemies]:
+            for store, collected in zip(stores, coins):
+                if coord in store:
+                    store.remove(coord)
+                    collected.append(coord)
+
+        # Coins remembered inside the vision square but no longer in the game state are gone
+        visible = [
+            {tuple(coin) for coin in game_state[key]}
+            for key in ("coin1", "coin2", "coin3")
+        ]
+        for coord in self.visible_coords():
+            for store, seen, collected in zip(stores, visible, coins):
+                if coord in store and coord not in seen:
+                    store.remove(coord)
+                    collected.append(coord)
         if coins[0] or coins[1] or coins[2]:
+            self.refresh(coins[0] + coins[1] + coins[2])
             self.observer.publish_collected(coins)
 
     def update_seen_coords(self):
         seen = []
-        for i in range(-2, 3):
-            for j in range(-2, 3):
-                curr_position = [
-                    self.current_position[0] + i,
-                    self.current_position[1] + j,
-                ]
-                if curr_position[0] < 0 or curr_position[0] == self.rows:
-                    continue
-                if curr_position[1] < 0 or curr_position[1] == self.columns:
-                    continue
-                if curr_position in self.seen_coords:
-                    continue
-                self.seen_coords.append(curr_position)
-                seen.append(curr_position)
+        for curr_position in self.visible_coords():
+            self.observed.add(curr_position)
+            if curr_position in self.seen_coords:
+                continue
+            seen.append(curr_position)
+        self.add_seen(seen)
         if seen:
             self.observer.publish_seen(seen)
 
+    def add_seen(self, coords: list[Coord]):
+        self.seen_coords.update(coords)
+        if coords:
+            xs, ys = zip(*coords)
+            self.unseen[xs, ys] = False
+
     def update_teammates(self, player_name, player_position):
-        if player_name not in self.teammate_names:
-            self.teammate_names.append(player_name)
-            self.teammates.append(player_position)
-            return
-        for i in range(len(self.teammates)):
-            if self.teammate_names[i] != player_name:
-                continue
-            self.teammates[i] = player_position
+        old = self.teammates.get(player_name)
+        self.teammates[player_name] = tuple(player_position)
+        self.refresh([self.teammates[player_name]] if old is None else [old, self.teammates[player_name]])
+
+    def add_coins(self, coins: list[list[Coord]]):
+        """
+        :param coins: coins a teammate saw, [[coin1, ...], [coin2, ...], [coin3, ...]]
+        """
+        for store, new_coins in zip((self.coin1, self.coin2, self.coin3), coins):
+            store.update(new_coins)
+            self.refresh(new_coins)
+
+    def remove_coins(self, coins: list[list[Coord]]):
+        """
+        :param coins: coins a teammate collected, [[coin1, ...], [coin2, ...], [coin3, ...]]
+        """
+        for store, collected in zip((self.coin1, self.coin2, self.coin3), coins):
+            store.difference_update(collected)
+            self.refresh(collected)
 
     def update_seen_coins(self, game_state: dict):
         coins = [[], [], []]
-        for coin in game_state["coin1"]:
-            if coin in self.coin1:
-                continue
-            coins[0].append(coin)
-            self.coin1.append(coin)
-        for coin in game_state["coin2"]:
-            if coin in self.coin2:
-                continue
-            coins[1].append(coin)
-            self.coin2.append(coin)
-        for coin in game_state["coin3"]:
-            if coin in self.coin3:
-                continue
-            coins[2].append(coin)
-            self.coin3.append(coin)
+        stores = (self.coin1, self.coin2, self.coin3)
+        for key, store, seen in zip(("coin1", "coin2", "coin3"), stores, coins):
+            for coin in game_state[key]:
+                coin = tuple(coin)
+                if coin in store:
+                    continue
+                seen.append(coin)
+                store.add(coin)
         if coins[0] or coins[1] or coins[2]:
+            self.refresh(coins[0] + coins[1] + coins[2])
             self.observer.publish_coins(coins)
 
     def update_walls(self, game_state: dict):
-        seen_walls = []
-        for wall in game_state["walls"]:
-            if wall in self.walls:
-                continue
-            self.walls.append(wall)
-            seen_walls.append(wall)
+        seen_walls = self.add_walls(tuple(wall) for wall in game_state["walls"])
         if seen_walls:
             self.observer.publish_walls(seen_walls)
 
+    def add_walls(self, walls) -> list[Coord]:
+        """
+        :return: the walls that were not known yet, finding one drops the cached distances
+        """
+        new_walls = [wall for wall in walls if wall not in self.walls]
+        if new_walls:
+            self.walls.update(new_walls)
+            self.distances.add_walls(new_walls)
+            self.refresh(new_walls)
+        return new_walls
+
     def load_visible_map(self, game_state: dict):
-        self.current_position = game_state["currentPosition"]
-        self.enemies = game_state["enemyPositions"]
+        # self.map is kept up to date cell by cell, only what changed this turn is repainted
+        self.current_position = tuple(game_state["currentPosition"])
+        enemies = {tuple(enemy) for enemy in game_state["enemyPositions"]}
+        enemies |= self.team_enemies
+        moved, self.enemies = self.enemies ^ enemies, enemies
+        self.refresh(moved)
         self.remove_collected_coins(game_state)
         self.update_seen_coords()
         self.update_seen_coins(game_state)
         self.update_walls(game_state)
-        self.map = [[0 for i in range(self.rows)] for j in range(self.columns)]
-        for teammate in self.teammates:
-            self.map[teammate[0]][teammate[1]] = -1
-        for enemy in self.enemies:
-            self.map[enemy[0]][enemy[1]] = -1
-        for wall in self.walls:
-            if wall[0] < 0 or wall[0] == self.rows:
-                continue
-            if wall[1] < 0 or wall[1] == self.columns:
+
+    def load_team_state(self, team_state: dict):
+        """
+        Merges the team's combined vision published by a server running with TEAM_VISION=1,
+        it arrives just before this turn's game_state
+        """
+        players = {name: tuple(loc) for name, loc in team_state["players"].items()}
+        window = set()
+        for name, loc in players.items():
+            if name != self.player_name:
+                self.update_teammates(name, loc)
+            window.update(self.visible_coords(loc))
+        self.add_seen(list(window - self.seen_coords))
+        self.add_walls(tuple(wall) for wall in team_state["walls"])
+        visible = [
+            {tuple(coin) for coin in team_state[key]}
+            for key in ("coin1", "coin2", "coin3")
+        ]
+        stores = (self.coin1, self.coin2, self.coin3)
+        self.remove_coins(
+            [[coord for coord in window if coord in store and coord not in seen]
+             for store, seen in zip(stores, visible)]
+        )
+        self.add_coins([list(seen - store) for store, seen in zip(stores, visible)])
+        self.team_enemies = {tuple(enemy) for enemy in team_state["enemyPositions"]}
+
+    def refresh(self, coords):
+        """
+        Repaints cells of self.map from the knowledge stores, coins win over players and walls
+        """
+        for coord in coords:
+            if not (0 <= coord[0] < self.rows and 0 <= coord[1] < self.columns):
                 continue
-            self.map[wall[0]][wall[1]] = -1
-        for coin in self.coin1:
-            self.map[coin[0]][coin[1]] = 1
-        for coin in self.coin2:
-            self.map[coin[0]][coin[1]] = 2
-        for coin in self.coin3:
-            self.map[coin[0]][coin[1]] = 3
+            if coord in self.coin3:
+                value = 3
+            elif coord in self.coin2:
+                value = 2
+            elif coord in self.coin1:
+                value = 1
+            elif (
+                coord in self.walls
+                or coord in self.enemies
+                or coord in self.teammates.values()
+            ):
+                value = -1
+            else:
+                value = 0
+            self.map[coord] = value
 
     def next_move(self):
-        # perform bfs on the entire known map
+        # score every known coin and unseen cell at once from the cached distances of each open first step
         moves = [
             ([0, -1], "LEFT"),
             ([0, 1], "RIGHT"),
             ([-1, 0], "UP"),
             ([1, 0], "DOWN"),
         ]
-        queue = []
-        visited = []
         best_score = 9999
         init_choice = choice(moves)
         best_direction = init_choice[1]
-        next_coords = [
-            self.current_position[0] + init_choice[0][0],
-            self.current_position[1] + init_choice[0][1],
-        ]
-        curr_node = self.current_position
+
+        # score = distance * scale + offset with the first step folded into offset, cells that
+        # are no target get an infinite offset. An unreachable distance scores at least
+        # UNREACHABLE / 3, which never beats best_score
+        start = self.current_position
+        codes = self.map.ravel().view(np.uint8) + np.uint8(1)
+        codes += self.unseen.ravel().view(np.uint8) * np.uint8(5)
+        scale = SCALE.take(codes)
+        offset = OFFSET.take(codes)
+        offset[start[0] * self.columns + start[1]] = np.inf
+        if self.enemy_penalty and self.enemies:
+            self.add_enemy_costs(offset)
+        scores = np.empty(codes.size, dtype=np.float32)
+
         for move, direction in moves:
-            neighbor = [curr_node[0] + move[0], curr_node[1] + move[1]]
-            if neighbor in visited:
-                continue
+            neighbor = (start[0] + move[0], start[1] + move[1])
             if neighbor[0] < 0 or neighbor[0] == self.rows:
                 continue
             if neighbor[1] < 0 or neighbor[1] == self.columns:
                 continue
-            if self.map[neighbor[0]][neighbor[1]] == -1:
+            if self.map[neighbor[0], neighbor[1]] == -1:
                 continue
-            queue.append((neighbor, direction, 1))
-        while len(queue) > 0:
-            curr_node, direction, path_len = queue.pop(0)
-            for move, _ in moves:
-                neighbor = [curr_node[0] + move[0], curr_node[1] + move[1]]
-                if neighbor in visited:
-                    continue
-                if neighbor[0] < 0 or neighbor[0] == self.rows:
-                    continue
-                if neighbor[1] < 0 or neighbor[1] == self.columns:
-                    continue
-                if self.map[neighbor[0]][neighbor[1]] == -1:
+            field = np.frombuffer(self.distances.field(neighbor), dtype=np.uint16)
+            np.multiply(field, scale, out=scores)
+            scores += offset
+            index = scores.argmin()
+            if scores[index] < best_score:
+                best_score = scores[index]
+                best_direction = direction
+
+        for move, direction in moves:
+            if direction == best_direction:
+                next_coords = [start[0] + move[0], start[1] + move[1]]
+                return best_direction, next_coords
+
+    def add_enemy_costs(self, offset: np.ndarray):
+        radius = self.enemy_radius
+        for enemy in self.enemies:
+            for dx in range(-radius, radius + 1):
+                x = enemy[0] + dx
+                if x < 0 or x >= self.rows:
                     continue
-                queue.append((neighbor, direction, path_len + 1))
-            if self.map[curr_node[0]][curr_node[1]] > 0:
-                score = path_len / self.map[curr_node[0]][curr_node[1]]
-                if score < best_score:
-                    best_score = score
-                    best_direction = direction
-                    for move, dir in moves:
-                        if dir != best_direction:
-                            continue
-                        next_coords = [
-                            self.current_position[0] + move[0],
-                            self.current_position[1] + move[1],
-                        ]
-                        break
-            elif curr_node not in self.seen_coords:
-                score = path_len + 200
-                if score < best_score:
-                    best_score = score
-                    best_direction = direction
-                    for move, dir in moves:
-                        if dir != best_direction:
-                            continue
-                        next_coords = [
-                            self.current_position[0] + move[0],
-                            self.current_position[1] + move[1],
-                        ]
-                        break
-            visited.append(curr_node)
-        return best_direction, next_coords
+                for dy in range(abs(dx) - radius, radius - abs(dx) + 1):
+                    y = enemy[1] + dy
+                    if 0 <= y < self.columns:
+                        steps = abs(dx) + abs(dy)
+                        offset[x * self.columns + y] += (
+                            self.enemy_penalty * (radius + 1 - steps) / (radius + 1)
+                        )
 
 
 def eucliedan_distance(a: list[int], b: list[int]):
@@ -355,52 +385,48 @@ def on_message(client, userdata, msg):
     player_client.handle_message(msg)
 
 
+# Moves are de-duplicated by the server and sync messages are superseded every turn,
+# neither needs the QoS 2 handshake
+DEFAULT_QOS = {"move": 1, "sync": 1}
+
+
 class AutoPlayerClient:
-    def __init__(self) -> None:
-        if len(argv) < 4:
-            print(
-                "Usage: python PlayerClient.py <player_name> <lobby_name> <team_name>"
-            )
-            exit(1)
+    def __init__(
+        self,
+        player_name: str,
+        lobby_name: str,
+        team_name: str,
+        client: paho.Client = None,
+        display: bool = True,
+        enemy_penalty: float = 0,
+        qos: dict[str, int] = None,
+        lookahead: float = 0,
+        endgame_coins: int = 12,
+    ) -> None:
+        """
+        :param client: shared connection that already routes this player's topics to handle_message,
+        a dedicated connection is opened when not given
+        :param display: print the known map every turn
+        :param enemy_penalty: how much the bot avoids targets next to enemies, see PlayerMap
+        :param qos: overrides DEFAULT_QOS per topic, e.g. {"sync": 0}
+        :param lookahead: seconds per turn for LookaheadPlanner, 0 keeps the greedy PlayerMap.next_move
+        :param endgame_coins: coins left at most for EndgameSolver to take over once the whole board is known, 0 never
+        """
         self.can_start = False
-        self.player_name = argv[1]
-        self.lobby_name = argv[2]
-        self.team_name = argv[3]
-        load_dotenv(dotenv_path="../credentials.env")
-        broker_address = os.environ.get("BROKER_ADDRESS")
-        broker_port = int(os.environ.get("BROKER_PORT"))
-        username = os.environ.get("USER_NAME")
-        password = os.environ.get("PASSWORD")
+        self.player_name = player_name
+        self.lobby_name = lobby_name
+        self.team_name = team_name
+        self.display = display
         self.ended = False
-        self.client = paho.Client(
-            client_id=self.player_name, userdata=None, protocol=paho.MQTTv5
-        )
-        # enable TLS for secure connection
-        self.client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
-        # set username and password
-        self.client.username_pw_set(username, password)
-        # connect to HiveMQ Cloud on port 8883 (default for MQTT)
-        self.client.connect(broker_address, broker_port)
-
-        # setting callbacks, use separate functions like above for better visibility
-        # self.client.on_subscribe = (
-        #     on_subscribe  # Can comment out to not print when subscribing to new topics
-        # )
-        self.client.on_message = on_message
-        # self.client.on_publish = (
-        #     on_publish  # Can comment out to not print when publishing to topics
-        # )
-        self.client.subscribe(f"games/{self.lobby_name}/lobby")
-        self.client.subscribe(f"games/{self.lobby_name}/{self.player_name}/game_state")
-        self.client.subscribe(f"games/{self.lobby_name}/scores")
-        self.client.subscribe(f"games/{self.lobby_name}/{self.team_name}/+/position")
-        self.client.subscribe(f"games/{self.lobby_name}/{self.team_name}/+/collected")
-        self.client.subscribe(f"games/{self.lobby_name}/{self.team_name}/+/seencoin")
-        self.client.subscribe(f"games/{self.lobby_name}/{self.team_name}/+/seenwall")
-        self.client.subscribe(f"games/{self.lobby_name}/{self.team_name}/+/seencoords")
-        self.client.subscribe(f"games/{self.lobby_name}/canstart")
-
-        self.map = PlayerMap(self, self.player_name, 10, 10)
+        if client is None:
+            client = self.connect()
+        self.client = client
+
+        self.qos = {**DEFAULT_QOS, **(qos or {})}
+        self.map = PlayerMap(self, self.player_name, 10, 10, enemy_penalty=enemy_penalty)
+        self.sync = TeamSync(self.map.rows, self.map.columns)
+        self.planner = LookaheadPlanner(deadline=lookahead) if lookahead > 0 else None
+        self.endgame = EndgameSolver(max_coins=endgame_coins) if endgame_coins > 0 else None
         self.curr_score: int = 0
 
         self.client.publish(
@@ -413,114 +439,187 @@ class AutoPlayerClient:
                 }
             ),
         )
-        time.sleep(1)  # Wait a second to resolve game start
 
-    def publish_collected(self, coins: list[list[list[int]]]):
-        self.client.publish(
-            f"games/{self.lobby_name}/{self.team_name}/{self.player_name}/collected",
-            str(coins),
-            qos=2,
-        )
+    def connect(self) -> paho.Client:
+        load_dotenv(dotenv_path="../credentials.env")
+        broker_address = os.environ.get("BROKER_ADDRESS")
+        broker_port = int(os.environ.get("BROKER_PORT"))
+        username = os.environ.get("USER_NAME")
+        password = os.environ.get("PASSWORD")
+        # Persistent session for this game, a reconnecting bot picks up the game_state it missed and plays on
+        client = SessionClient(f"{self.lobby_name}-{self.player_name}")
+        # set username and password
+        client.username_pw_set(username, password)
+        # connect to HiveMQ Cloud on port 8883 (default for MQTT)
+        client.connect(broker_address, broker_port)
 
-    def publish_coins(self, coins: list[list[list[int]]]):
+        # setting callbacks, use separate functions like above for better visibility
+        # client.on_subscribe = (
+        #     on_subscribe  # Can comment out to not print when subscribing to new topics
+        # )
+        client.on_message = on_message
+        # client.on_publish = (
+        #     on_publish  # Can comment out to not print when publishing to topics
+        # )
+        client.subscribe(f"games/{self.lobby_name}/lobby")
+        client.subscribe(f"games/{self.lobby_name}/{self.player_name}/game_state")
+        client.subscribe(f"games/{self.lobby_name}/scores")
+        client.subscribe(f"games/{self.lobby_name}/{self.team_name}/+/sync")
+        client.subscribe(f"games/{self.lobby_name}/{self.team_name}/team_state")
+        client.subscribe(f"games/{self.lobby_name}/canstart")
+        client.subscribe(f"games/{self.lobby_name}/{self.player_name}/explored_state")
+        client.on_session = self.on_session
+        return client
+
+    def on_session(self, client, session_present: bool):
+        # After a reconnect ask the server what the team has explored, messages may have been missed
+        if client.connections > 1:
+            self.request_explored()
+
+    def request_explored(self, team: bool = True):
         self.client.publish(
-            f"games/{self.lobby_name}/{self.team_name}/{self.player_name}/seencoin",
-            str(coins),
-            qos=2,
+            f"games/{self.lobby_name}/{self.player_name}/explored", "team" if team else "player", qos=1
         )
 
-    def publish_walls(self, wall: list[int]):
-        self.client.publish(
-            f"games/{self.lobby_name}/{self.team_name}/{self.player_name}/seenwall",
-            str(wall),
-            qos=2,
-        )
+    def load_explored(self, explored: str):
+        """
+        :param explored: base64 bitmap of explored cells, see Game.exploredData
+        """
+        self.map.add_seen(from_bitset(base64.b64decode(explored), self.map.columns))
+
+    # PlayerMap reports what it learned here, it is sent to the team in one sync message per turn
+    def publish_collected(self, coins: list[list[Coord]]):
+        self.sync.record_coins(coins, collected=True)
 
-    def publish_seen(self, seen: list[int]):
+    def publish_coins(self, coins: list[list[Coord]]):
+        self.sync.record_coins(coins)
+
+    def publish_walls(self, walls: list[Coord]):
+        self.sync.record_walls(walls)
+
+    def publish_seen(self, seen: list[Coord]):
+        self.sync.record_seen(seen)
+
+    def publish_sync(self, coords: list[int]):
+        """
+        Sends this turn's news and the planned position, or all our knowledge if a teammate fell behind
+        """
+        full_map = self.map if self.sync.needs_full() else None
         self.client.publish(
-            f"games/{self.lobby_name}/{self.team_name}/{self.player_name}/seencoords",
-            str(seen),
-            qos=2,
+            f"games/{self.lobby_name}/{self.team_name}/{self.player_name}/sync",
+            self.sync.encode(coords, full_map),
+            qos=self.qos["sync"],
         )
 
+    def receive_sync(self, player_name: str, payload: bytes):
+        message = self.sync.receive(player_name, self.player_name, payload)
+        if message is None:
+            return
+        self.map.update_teammates(player_name, message["position"])
+        self.map.add_seen(message["seen"])
+        self.map.add_walls(message["walls"])
+        if message["full"]:
+            # Coins are never placed after the start, one on a cell the sender looked at itself
+            # but does not list is gone. Cells it only heard of may hide a coin it never learned about
+            observed = set(message["observed"])
+            listed = {coord for coins in message["coins"] for coord in coins}
+            self.map.remove_coins([
+                [coord for coord in store if coord in observed and coord not in listed]
+                for store in (self.map.coin1, self.map.coin2, self.map.coin3)
+            ])
+        self.map.add_coins(message["coins"])
+        self.map.remove_coins(message["collected"])
+
     def handle_message(self, msg):
-        if "Error" in msg.payload.decode():
+        if self.ended:
+            return
+        topic_list = msg.topic.split("/")
+        if topic_list[-1] == "sync":
+            # Binary payload, handled before anything tries to decode it as text
+            if topic_list[3] != self.player_name:
+                self.receive_sync(topic_list[3], msg.payload)
+            return
+        if topic_list[-1] == "lobby" and "Error" in msg.payload.decode():
             self.ended = True
-            exit(1)
-        if "Game Over" in msg.payload.decode():
+            return
+        if topic_list[-1] == "lobby" and "Game Over" in msg.payload.decode():
             self.ended = True
             print(f"Game over\nScore: {self.map.score}")
-            exit(0)
+            return
         if msg.topic == f"games/{self.lobby_name}/{self.player_name}/game_state":
-            game_state = json.loads(msg.payload.decode())
-            self.map.load_visible_map(game_state)
-            self.map.print_map()
-            direction, next_coords = self.map.next_move()
-            self.move(direction, next_coords)
-        topic_list = msg.topic.split("/")
+            self.play_turn(json.loads(msg.payload.decode()))
+        if topic_list[-1] == "explored_state":
+            self.load_explored(json.loads(msg.payload.decode())["explored"])
         if topic_list[-1] == "scores":
             scores = json.loads(msg.payload.decode())
-            self.map.score = scores[self.team_name]
-        if topic_list[-1] == "position":
-            if topic_list[3] != self.player_name:
-                self.map.update_teammates(
-                    topic_list[3], json.loads(msg.payload.decode())
-                )
-        if topic_list[-1] == "collected":
-            coins = json.loads(msg.payload.decode())
-            if topic_list[3] != self.player_name:
-                for coin in coins[0]:
-                    if coin in self.map.coin1:
-                        self.map.coin1.remove(coin)
-                for coin in coins[1]:
-                    if coin in self.map.coin2:
-                        self.map.coin2.remove(coin)
-                for coin in coins[2]:
-                    if coin in self.map.coin3:
-                        self.map.coin3.remove(coin)
-        if topic_list[-1] == "seencoin":
-            coins = json.loads(msg.payload.decode())
-            if topic_list[3] != self.player_name:
-                for coin in coins[0]:
-                    if coin not in self.map.coin1:
-                        self.map.coin1.append(coin)
-                for coin in coins[1]:
-                    if coin not in self.map.coin2:
-                        self.map.coin2.append(coin)
-                for coin in coins[2]:
-                    if coin not in self.map.coin3:
-                        self.map.coin3.append(coin)
-        if topic_list[-1] == "seenwall":
-            walls = json.loads(msg.payload.decode())
-            if topic_list[3] != self.player_name:
-                for wall in walls:
-                    if wall in self.map.walls:
-                        continue
-                    self.map.walls.append(wall)
-        if topic_list[-1] == "seencoords":
-            coords = json.loads(msg.payload.decode())
-            if topic_list[3] != self.player_name:
-                for coord in coords:
-                    if coord in self.map.seen_coords:
-                        continue
-                    self.map.seen_coords.append(coord)
+            self.map.score = scores.get(self.team_name, self.map.score)
+        if topic_list[-1] == "team_state":
+            self.map.load_team_state(json.loads(msg.payload.decode()))
         if topic_list[-1] == "canstart":
             print("New lobby created, you may start the game by pressing s")
             self.can_start = True
 
+    def play_turn(self, game_state: dict):
+        if "explored" in game_state:
+            self.load_explored(game_state["explored"])
+        self.map.load_visible_map(game_state)
+        if self.display:
+            self.map.print_map()
+        endgame_move = self.endgame.next_move(self.map) if self.endgame is not None else None
+        if endgame_move is not None:
+            direction, next_coords = endgame_move
+            if self.display:
+                print(f"Endgame: {len(self.endgame.route)} coins on our route, solved in {self.endgame.last_ms:.1f} ms")
+        elif self.planner is None:
+            direction, next_coords = self.map.next_move()
+        else:
+            direction, next_coords = self.planner.next_move(self.map)
+            if self.display:
+                last = self.planner.last
+                print(f"Lookahead: depth {last['depth']}, {last['nodes']} nodes, {last['ms']:.1f} ms")
+        self.move(direction, next_coords)
+
+    def stats(self) -> dict:
+        """
+        :return: per turn depth, nodes and time of the lookahead planner and solves of the endgame solver,
+        for whichever of them the bot runs
+        """
+        stats = {}
+        if self.planner is not None:
+            stats["lookahead"] = self.planner.stats()
+        if self.endgame is not None:
+            stats["endgame"] = {"solves": self.endgame.solves, "last_ms": self.endgame.last_ms}
+        return stats
+
     def move(self, move: str, coords: list[int]):
+        self.publish_sync(coords)
         self.client.publish(
-            f"games/{self.lobby_name}/{self.team_name}/{self.player_name}/position",
-            str(coords),
-            qos=2,
-        )
-        self.client.publish(
-            f"games/{self.lobby_name}/{self.player_name}/move", move, qos=2
+            f"games/{self.lobby_name}/{self.player_name}/move", move, qos=self.qos["move"]
         )
 
 
 if __name__ == "__main__":
-    player_client = AutoPlayerClient()
+    from keyboard import read_event
+
+    parser = ArgumentParser(description="Bot that plays a game on its own, s starts the lobby and q stops it")
+    parser.add_argument("player_name")
+    parser.add_argument("lobby_name")
+    parser.add_argument("team_name")
+    parser.add_argument("--lookahead", type=float, default=0, help="seconds of lookahead search per turn, 0 plays greedy")
+    parser.add_argument("--enemy-penalty", type=float, default=0, help="how much targets next to enemies are avoided")
+    parser.add_argument("--endgame-coins", type=int, default=12, help="coins left for the endgame solver, 0 never")
+    parser.add_argument("--quiet", action="store_true", help="do not print the map every turn")
+    args = parser.parse_args()
+    player_client = AutoPlayerClient(
+        args.player_name,
+        args.lobby_name,
+        args.team_name,
+        display=not args.quiet,
+        enemy_penalty=args.enemy_penalty,
+        lookahead=args.lookahead,
+        endgame_coins=args.endgame_coins,
+    )
+    time.sleep(1)  # Wait a second to resolve game start
     player_client.client.loop_start()
     while True:
         if player_client.ended:
@@ -541,3 +640,4 @@ if __name__ == "__main__":
                         f"games/{player_client.lobby_name}/start", "START"
                     )
     player_client.client.loop_stop()
+    print(json.dumps(player_client.stats(), indent=2))
@@ -0,0 +1,193 @@
+import os
+import time
+import json
+import threading
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as paho
+from dotenv import load_dotenv
+
+from AutoPlayerClient import AutoPlayerClient
+from sessionClient import SessionClient
+
+
+class FleetBot(AutoPlayerClient):
+    def __init__(self, fleet, *args, **kwargs) -> None:
+        """
+        AutoPlayerClient driven by a BotFleet, messages are handled one at a time on the fleet's pool
+        """
+        self.fleet = fleet
+        self.mailbox = deque()
+        self.scheduled = False
+        self.received: float = None
+        self.turns = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        super().__init__(*args, **kwargs)
+
+    def deliver(self, msg):
+        """
+        Queues a message for this bot, called from the connection's network thread
+        """
+        with self.fleet.lock:
+            self.mailbox.append((time.perf_counter(), msg))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.fleet.pool.submit(self.drain)
+
+    def drain(self):
+        # Runs on the pool, a bot never handles two of its messages at once
+        while True:
+            with self.fleet.lock:
+                if not self.mailbox:
+                    self.scheduled = False
+                    return
+                self.received, msg = self.mailbox.popleft()
+            self.handle_message(msg)
+
+    def move(self, move: str, coords: list[int]):
+        super().move(move, coords)
+        latency = time.perf_counter() - self.received
+        self.turns += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def stats(self) -> dict:
+        """
+        :return: turns played and decision latency in milliseconds, from game_state arrival to move publish,
+        with the planner statistics of AutoPlayerClient.stats
+        """
+        return {
+            "turns": self.turns,
+            "latency_mean_ms": 1000 * self.latency_total / self.turns if self.turns else 0,
+            "latency_max_ms": 1000 * self.latency_max,
+            **super().stats(),
+        }
+
+
+class BotFleet:
+    def __init__(self, connections: int = 1, workers: int = 8, prefix: str = "fleet"):
+        """
+        Runs many bots in one process over a few shared broker connections
+        :param connections: number of MQTT connections the bots are spread over
+        :param workers: threads the bots plan their moves on
+        :param prefix: names the connections' client ids, each run starts them with a clean session
+        """
+        load_dotenv(dotenv_path="../credentials.env")
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.clients = [self.connect(f"BotFleet-{prefix}-{i}") for i in range(connections)]
+        self.bots: dict[tuple[str, str], FleetBot] = {}  # {(lobby, player) : bot}
+        self.teams: dict[tuple[str, str], list[FleetBot]] = {}  # {(lobby, team) : [bot, ...]}
+        self.lobbies: dict[str, list[FleetBot]] = {}  # {lobby : [bot, ...]}
+        self.lobby_clients: dict[str, paho.Client] = {}
+
+    def connect(self, client_id: str) -> paho.Client:
+        client = SessionClient(client_id)
+        # set username and password
+        client.username_pw_set(os.environ.get("USER_NAME"), os.environ.get("PASSWORD"))
+        # connect to HiveMQ Cloud on port 8883 (default for MQTT)
+        client.connect(os.environ.get("BROKER_ADDRESS"), int(os.environ.get("BROKER_PORT")))
+        client.on_message = self.on_message
+        client.loop_start()
+        return client
+
+    def add_bot(self, player_name: str, lobby_name: str, team_name: str, **options) -> FleetBot:
+        """
+        :param options: lookahead, enemy_penalty and endgame_coins as taken by AutoPlayerClient
+        """
+        # A lobby lives on one connection so each of its messages arrives exactly once
+        if lobby_name not in self.lobbies:
+            client = self.clients[len(self.lobbies) % len(self.clients)]
+            self.lobbies[lobby_name] = []
+            self.lobby_clients[lobby_name] = client
+            self.subscribe_lobby(client, lobby_name)
+        client = self.lobby_clients[lobby_name]
+        bot = FleetBot(self, player_name, lobby_name, team_name, client=client, display=False, **options)
+        self.bots[(lobby_name, player_name)] = bot
+        self.teams.setdefault((lobby_name, team_name), []).append(bot)
+        self.lobbies[lobby_name].append(bot)
+        return bot
+
+    @staticmethod
+    def subscribe_lobby(client: paho.Client, lobby_name: str):
+        # Everything a bot listens to, without echoing the fleet's own move publishes back
+        client.subscribe(f"games/{lobby_name}/lobby")
+        client.subscribe(f"games/{lobby_name}/scores")
+        client.subscribe(f"games/{lobby_name}/canstart")
+        client.subscribe(f"games/{lobby_name}/+/game_state")
+        client.subscribe(f"games/{lobby_name}/+/team_state")
+        client.subscribe(f"games/{lobby_name}/+/explored_state")
+        client.subscribe(f"games/{lobby_name}/+/+/+")
+
+    def on_message(self, client, userdata, msg):
+        """
+        Dispatches a message to the bots it concerns
+        :param client: the connection that received the message
+        :param userdata: userdata is set when initiating the client, here it is userdata=None
+        :param msg: the message with topic and payload
+        """
+        topic_list = msg.topic.split("/")
+        lobby_name = topic_list[1]
+        if len(topic_list) == 3:
+            recipients = self.lobbies.get(lobby_name, [])
+        elif topic_list[-1] in ("game_state", "explored_state"):
+            bot = self.bots.get((lobby_name, topic_list[2]))
+            recipients = [bot] if bot is not None else []
+        else:
+            recipients = self.teams.get((lobby_name, topic_list[2]), [])
+        for bot in recipients:
+            bot.deliver(msg)
+
+    def start(self, lobby_name: str):
+        self.lobby_clients[lobby_name].publish(f"games/{lobby_name}/start", "START")
+
+    def running(self) -> bool:
+        return any(not bot.ended for bot in self.bots.values())
+
+    def stats(self) -> dict:
+        return {f"{lobby}/{player}": bot.stats() for (lobby, player), bot in self.bots.items()}
+
+    def close(self):
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
+        self.pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Run many AutoPlayerClients in one process")
+    parser.add_argument("--lobbies", type=int, default=1)
+    parser.add_argument("--teams", type=int, default=2, help="teams per lobby")
+    parser.add_argument("--players", type=int, default=2, help="players per team")
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--prefix", default="fleet")
+    parser.add_argument("--lookahead", type=float, default=0, help="seconds of lookahead search per turn, 0 plays greedy")
+    parser.add_argument("--enemy-penalty", type=float, default=0, help="how much targets next to enemies are avoided")
+    parser.add_argument("--endgame-coins", type=int, default=12, help="coins left for the endgame solver, 0 never")
+    args = parser.parse_args()
+
+    fleet = BotFleet(args.connections, args.workers, args.prefix)
+    for lobby in range(args.lobbies):
+        for team in range(args.teams):
+            for player in range(args.players):
+                fleet.add_bot(
+                    f"{args.prefix}{lobby}-{team}-{player}",
+                    f"{args.prefix}{lobby}",
+                    f"{args.prefix}{lobby}-team{team}",
+                    lookahead=args.lookahead,
+                    enemy_penalty=args.enemy_penalty,
+                    endgame_coins=args.endgame_coins,
+                )
+    time.sleep(1)  # Wait a second to resolve game start
+    for lobby in range(args.lobbies):
+        fleet.start(f"{args.prefix}{lobby}")
+
+    while fleet.running():
+        time.sleep(1)
+    print(json.dumps(fleet.stats(), indent=2))
+    fleet.close()
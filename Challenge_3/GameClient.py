@@ -1,15 +1,34 @@
 import os
 import json
 import copy
+import queue
+import threading
+import multiprocessing
 from collections import OrderedDict
 
-import paho.mqtt.client as paho
-from paho import mqtt
 from dotenv import load_dotenv
 
 from InputTypes import NewPlayer
 from game import Game
 from moveset import Moveset
+from rateLimit import MoveLimiter
+from outbound import OutboundQueue
+from checkpoint import (
+    Checkpointer,
+    load_checkpoint,
+    restore_lobbies,
+    restore_lobby,
+    snapshot_lobby,
+)
+from timerWheel import TimerWheel
+from turnScheduler import TurnScheduler
+from tickLoop import TickLoop
+from sharding import ShardRouter
+from lobbyDirectory import LobbyDirectory
+from sessionClient import SessionClient
+from spectate import SpectatorStream
+from sharedBoard import SharedBoard
+from teamVision import TeamVision
 
 
 # setting callbacks for different events to see if it works, print the message etc.
@@ -28,12 +47,13 @@ def on_connect(client, userdata, flags, rc, properties=None):
 # with this callback you can see if your publish was successful
 def on_publish(client, userdata, mid, properties=None):
     """
-    Prints mid to stdout to reassure a successful publish ( used as callback for publish )
+    Releases the outbound queue for the published topic and prints mid to stdout ( used as callback for publish )
     :param client: the client itself
     :param userdata: userdata is set when initiating the client, here it is userdata=None
     :param mid: variable returned from the corresponding publish() call, to allow outgoing messages to be tracked
     :param properties: can be used in MQTTv5, but is optional
     """
+    client.post(client.outbound.on_publish, mid)
     print("mid: " + str(mid))
 
 
@@ -53,19 +73,53 @@ def on_subscribe(client, userdata, mid, granted_qos, properties=None):
 # triggered on message from subscription
 def on_message(client, userdata, msg):
     """
-    Runs game logic and dispatches behavior depending on route
+    Hands the message to the game thread ( used as callback for subscribe )
     :param client: the client itself
     :param userdata: userdata is set when initiating the client, here it is userdata=None
     :param msg: the message with topic and payload
     """
     print("message: " + msg.topic + " " + str(msg.qos) + " " + str(msg.payload))
-    topic_list = msg.topic.split("/")
+    client.post(handle_message, client, msg)
+
+
+def handle_message(client, msg):
+    """
+    Runs game logic and dispatches behavior depending on route, on the game thread
+    """
+    topic_list = client.router.local_topic(msg.topic.split("/"))
+
+    # Lobbies live on exactly one server, pass along anything that arrived at the wrong one
+    if client.router.intercept(client, topic_list, msg.payload):
+        return
 
     # Validate it is input we can deal with
     if topic_list[-1] in dispatch.keys():
         dispatch[topic_list[-1]](client, topic_list, msg.payload)
 
 
+def serve(client):
+    """
+    The game thread: runs everything posted with client.post one at a time. Only this thread touches
+    the lobbies and publishes, paho's network thread and the timers just post to it, so no lock is held
+    while paho takes its own
+    """
+    while True:
+        function, args = client.tasks.get()
+        function(*args)
+
+
+def call(client, function, *args):
+    # Runs function on the game thread and waits for it, so the tick loop times the real work
+    done = threading.Event()
+
+    def run():
+        function(*args)
+        done.set()
+
+    client.post(run)
+    done.wait()
+
+
 # Dispatched function, adds player to a lobby & team
 def add_player(client, topic_list, msg_payload):
     # Parse and Validate Input Data
@@ -79,7 +133,7 @@ def add_player(client, topic_list, msg_payload):
     if player.lobby_name not in client.team_dict.keys():
         client.team_dict[player.lobby_name] = {}
         client.team_dict[player.lobby_name]["started"] = False
-        client.publish(f"games/{player.lobby_name}/canstart", "")
+        client.outbound.publish(f"games/{player.lobby_name}/canstart", "")
 
     if client.team_dict[player.lobby_name]["started"]:
         publish_error_to_lobby(
@@ -89,6 +143,7 @@ def add_player(client, topic_list, msg_payload):
         )
 
     add_team(client, player)
+    save_checkpoint(client, player.lobby_name)
 
     print(f"Added Player: {player.player_name} to Team: {player.team_name}")
 
@@ -116,48 +171,103 @@ move_to_Moveset = {
 def player_move(client, topic_list, msg_payload):
     lobby_name = topic_list[1]
     player_name = topic_list[2]
-    if lobby_name in client.team_dict.keys():
-        try:
-            new_move = msg_payload.decode()
-
-            client.move_dict[lobby_name][player_name] = (
-                player_name,
-                move_to_Moveset[new_move],
-            )
-            game: Game = client.game_dict[lobby_name]
-
-            # If all players made a move, resolve movement
-            if len(game.all_players) == len(client.move_dict[lobby_name]):
-                for player, move in client.move_dict[lobby_name].values():
-                    game.movePlayer(player, move)
-
-                # Publish player states after all movement is resolved
-                for player, _ in client.move_dict[lobby_name].values():
-                    client.publish(
-                        f"games/{lobby_name}/{player}/game_state",
-                        json.dumps(game.getGameData(player)),
-                    )
-
-                # Clear move list
-                client.move_dict[lobby_name].clear()
-                print(game.map)
-                client.publish(
-                    f"games/{lobby_name}/scores", json.dumps(game.getScores())
-                )
-                if game.gameOver():
-                    # Publish game over, remove game
-                    publish_to_lobby(
-                        client, lobby_name, "Game Over: All coins have been collected"
-                    )
-                    client.team_dict.pop(lobby_name)
-                    client.move_dict.pop(lobby_name)
-                    client.game_dict.pop(lobby_name)
-
-        except Exception as e:
-            raise e
-            publish_error_to_lobby(client, lobby_name, e.__str__)
-    else:
+    if lobby_name not in client.team_dict.keys():
         publish_error_to_lobby(client, lobby_name, "Lobby name not found.")
+        return
+    game: Game = client.game_dict.get(lobby_name)
+    # Moves for games not started yet or from strangers never get a bucket in the limiter
+    if game is None or player_name not in game.all_players:
+        return
+    # Drop floods and repeated moves before doing any decoding or game work
+    if not client.move_limiter.admit(lobby_name, player_name, msg_payload):
+        return
+
+    try:
+        new_move = msg_payload.decode()
+
+        client.move_dict[lobby_name][player_name] = (
+            player_name,
+            move_to_Moveset[new_move],
+        )
+
+        # If all players made a move, resolve movement, real-time games wait for the next tick
+        if client.tick_loop is None and len(game.all_players) == len(
+            client.move_dict[lobby_name]
+        ):
+            resolve_turn(client, lobby_name)
+
+    except Exception as e:
+        raise e
+        publish_error_to_lobby(client, lobby_name, e.__str__)
+
+
+def resolve_turn(client, lobby_name):
+    # Players without a move this turn stay put
+    game: Game = client.game_dict[lobby_name]
+    board = client.shared_boards.get(lobby_name)
+    if board is not None:
+        # Sidecars see the board before or after the turn, never halfway through
+        board.begin()
+    for player, move in client.move_dict[lobby_name].values():
+        game.movePlayer(player, move)
+    if board is not None:
+        board.end()
+
+    # Team vision goes out first so it is there when a player plans on its game_state
+    if lobby_name in client.team_visions:
+        client.team_visions[lobby_name].turn_finished()
+
+    # Publish player states after all movement is resolved
+    for player in game.all_players.keys():
+        client.outbound.publish(
+            f"games/{lobby_name}/{player}/game_state",
+            json.dumps(game.getGameData(player, explored=client.explored_in_state)),
+            qos=1,
+        )
+
+    # Clear move list
+    client.move_dict[lobby_name].clear()
+    client.move_limiter.end_turn(lobby_name)
+    if client.print_maps:
+        print(game.map)
+    client.outbound.publish(f"games/{lobby_name}/scores", json.dumps(game.getScores()))
+    if lobby_name in client.spectators:
+        client.spectators[lobby_name].turn_finished()
+    if game.gameOver():
+        # Publish game over, remove game
+        publish_to_lobby(client, lobby_name, f"Game Over: {game.gameOverReason()}")
+        remove_lobby(client, lobby_name)
+        return
+
+    start_turn(client, lobby_name)
+    save_checkpoint(client, lobby_name, turn_finished=True)
+
+
+def turn_deadline(client, lobby_name, turn):
+    # Posted by the timer wheel thread once a lobby's turn ran out of time
+    if not client.turn_scheduler.is_current(lobby_name, turn):
+        return
+    if lobby_name not in client.game_dict:
+        return
+    game: Game = client.game_dict[lobby_name]
+    missing = [
+        player
+        for player in game.all_players.keys()
+        if player not in client.move_dict[lobby_name]
+    ]
+    print(f"Turn deadline in {lobby_name}, no move from: {', '.join(missing)}")
+    resolve_turn(client, lobby_name)
+
+
+def tick_lobbies(client):
+    # Run for the tick loop thread, every running game advances with the latest moves
+    for lobby_name in list(client.game_dict.keys()):
+        resolve_turn(client, lobby_name)
+
+
+def start_turn(client, lobby_name):
+    if client.turn_scheduler is not None:
+        client.turn_scheduler.start_turn(lobby_name)
 
 
 # Dispatched function: Instantiates Game object
@@ -170,23 +280,138 @@ def start_game(client, topic_list, msg_payload):
             dict_copy = copy.deepcopy(client.team_dict[lobby_name])
             dict_copy.pop("started")
 
-            game = Game(dict_copy)
+            game = Game(dict_copy, earlyFinish=client.early_finish)
             client.game_dict[lobby_name] = game
             client.move_dict[lobby_name] = OrderedDict()
             client.team_dict[lobby_name]["started"] = True
+            open_views(client, lobby_name)
 
             for player in game.all_players.keys():
-                client.publish(
+                client.outbound.publish(
                     f"games/{lobby_name}/{player}/game_state",
-                    json.dumps(game.getGameData(player)),
+                    json.dumps(game.getGameData(player, explored=client.explored_in_state)),
+                    qos=1,
                 )
 
-            print(game.map)
+            if client.print_maps:
+                print(game.map)
+            start_turn(client, lobby_name)
+            save_checkpoint(client, lobby_name)
     elif isinstance(msg_payload, bytes) and msg_payload.decode() == "STOP":
         publish_to_lobby(client, lobby_name, "Game Over: Game has been stopped")
-        client.team_dict.pop(lobby_name, None)
-        client.move_dict.pop(lobby_name, None)
-        client.game_dict.pop(lobby_name, None)
+        remove_lobby(client, lobby_name)
+
+
+def open_views(client, lobby_name):
+    # Spectator stream, shared memory board and team vision, all follow the game through its events
+    if client.spectate_rate > 0:
+        client.spectators[lobby_name] = SpectatorStream(
+            lobby_name,
+            client.game_dict[lobby_name],
+            client.outbound.publish,
+            max_rate=client.spectate_rate,
+        )
+    if client.shared_boards_enabled:
+        client.shared_boards[lobby_name] = SharedBoard(lobby_name, client.game_dict[lobby_name])
+    if client.team_vision_enabled:
+        client.team_visions[lobby_name] = TeamVision(
+            lobby_name, client.game_dict[lobby_name], client.outbound.publish
+        )
+        client.team_visions[lobby_name].turn_finished()
+
+
+def remove_lobby(client, lobby_name):
+    spectators = client.spectators.pop(lobby_name, None)
+    if spectators is not None:
+        spectators.close()
+    board = client.shared_boards.pop(lobby_name, None)
+    if board is not None:
+        board.close()
+    vision = client.team_visions.pop(lobby_name, None)
+    if vision is not None:
+        vision.close()
+    client.team_dict.pop(lobby_name, None)
+    client.move_dict.pop(lobby_name, None)
+    client.game_dict.pop(lobby_name, None)
+    client.move_limiter.remove_lobby(lobby_name)
+    if client.turn_scheduler is not None:
+        client.turn_scheduler.remove_lobby(lobby_name)
+    save_checkpoint(client, lobby_name)
+
+
+def attach_lobby(client, lobby_name, snapshot):
+    # A lobby handed over by another node, its players keep publishing to the same topics
+    if restore_lobby(client, lobby_name, snapshot):
+        open_views(client, lobby_name)
+        start_turn(client, lobby_name)
+    save_checkpoint(client, lobby_name)
+
+
+def detach_lobby(client, lobby_name):
+    snapshot = snapshot_lobby(client, lobby_name)
+    remove_lobby(client, lobby_name)
+    return snapshot
+
+
+def replay_message(client, topic_list, msg_payload):
+    if topic_list[-1] in dispatch.keys():
+        dispatch[topic_list[-1]](client, topic_list, msg_payload)
+
+
+def save_checkpoint(client, lobby_name, turn_finished=False):
+    if client.checkpointer is None:
+        return
+    if turn_finished:
+        client.checkpointer.turn_finished(client, lobby_name)
+    else:
+        client.checkpointer.capture(client, lobby_name)
+
+
+def resume_lobbies(client, snapshot):
+    # Re-publish every player's state so bots carry on with the restored turn
+    for lobby_name in restore_lobbies(client, snapshot):
+        game = client.game_dict[lobby_name]
+        for player in game.all_players.keys():
+            client.outbound.publish(
+                f"games/{lobby_name}/{player}/game_state",
+                json.dumps(game.getGameData(player, explored=client.explored_in_state)),
+                qos=1,
+            )
+        open_views(client, lobby_name)
+        start_turn(client, lobby_name)
+        print(f"Resumed lobby: {lobby_name}")
+
+
+# Dispatched function: sends a player the cells it (payload "player") or its team (payload "team") has seen
+def publish_explored(client, topic_list, msg_payload):
+    lobby_name, player_name = topic_list[1], topic_list[2]
+    game: Game = client.game_dict.get(lobby_name)
+    if game is None or player_name not in game.all_players:
+        return
+    team = msg_payload == b"team"
+    client.outbound.publish(
+        f"games/{lobby_name}/{player_name}/explored_state",
+        json.dumps({"team": team, "explored": game.exploredData(player_name, team)}),
+        qos=1,
+    )
+
+
+# Dispatched function: reports server side counters
+def publish_stats(client, topic_list, msg_payload):
+    client.outbound.publish("server/stats/report", json.dumps(get_stats(client)))
+
+
+def get_stats(client):
+    return {
+        "shard": client.router.stats(),
+        "lobbies": len(client.team_dict),
+        "games": len(client.game_dict),
+        "moves": client.move_limiter.stats(),
+        "outbound": client.outbound.stats(),
+        "checkpoint": client.checkpointer.stats() if client.checkpointer else None,
+        "turns": client.turn_scheduler.stats() if client.turn_scheduler else None,
+        "ticks": client.tick_loop.stats() if client.tick_loop else None,
+    }
 
 
 def publish_error_to_lobby(client, lobby_name, error):
@@ -194,28 +419,50 @@ def publish_error_to_lobby(client, lobby_name, error):
 
 
 def publish_to_lobby(client, lobby_name, msg):
-    client.publish(f"games/{lobby_name}/lobby", msg)
+    client.outbound.publish(f"games/{lobby_name}/lobby", msg, qos=1)
 
 
 dispatch = {
     "new_game": add_player,
     "move": player_move,
     "start": start_game,
+    "stats": publish_stats,
+    "explored": publish_explored,
 }
 
 
-if __name__ == "__main__":
-    load_dotenv(dotenv_path="../credentials.env")
-
+def run_server(shard=0, num_shards=1):
+    """
+    Connects one game server worker and serves its lobbies until the process is stopped
+    :param shard: index of this worker
+    :param num_shards: number of workers splitting the lobbies between them
+    """
     broker_address = os.environ.get("BROKER_ADDRESS")
     broker_port = int(os.environ.get("BROKER_PORT"))
     username = os.environ.get("USER_NAME")
     password = os.environ.get("PASSWORD")
 
-    client = paho.Client(client_id="GameClient", userdata=None, protocol=paho.MQTTv5)
+    client_id = "GameClient" if num_shards == 1 else f"GameClient-{shard}"
+    # Persistent session, moves published while the server reconnects are delivered afterwards
+    client = SessionClient(
+        client_id, session_expiry=int(os.environ.get("SESSION_EXPIRY", 3600))
+    )
+
+    turn_deadline_seconds = float(os.environ.get("TURN_DEADLINE", 5))
+    # NODE_ID joins a consistent hash ring of servers that hand lobbies over as nodes come and go
+    node_id = os.environ.get("NODE_ID")
+    if node_id:
+        client.router = LobbyDirectory(
+            node_id,
+            attach_lobby,
+            detach_lobby,
+            replay_message,
+            max_pause=turn_deadline_seconds or None,
+        )
+        client.will_set(client.router.will_topic(), "", qos=1, retain=True)
+    else:
+        client.router = ShardRouter(shard, num_shards)
 
-    # enable TLS for secure connection
-    client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
     # set username and password
     client.username_pw_set(username, password)
     # connect to HiveMQ Cloud on port 8883 (default for MQTT)
@@ -226,8 +473,13 @@ if __name__ == "__main__":
         on_subscribe  # Can comment out to not print when subscribing to new topics
     )
     client.on_message = on_message
-    client.on_publish = (
-        on_publish  # Can comment out to not print when publishing to topics
+    client.on_publish = on_publish  # Required, acknowledges the outbound queue
+
+    # Bounded per topic publish queue, unsent game_state messages are superseded by newer ones
+    client.outbound = OutboundQueue(
+        client,
+        max_depth=int(os.environ.get("OUTBOUND_MAX_DEPTH", 32)),
+        latest_only=("game_state", "team_state", "spectate"),
     )
 
     # custom dictionary to track players
@@ -236,9 +488,98 @@ if __name__ == "__main__":
     )  # Keeps tracks of players before a game starts {'lobby_name' : {'team_name' : [player_name, ...]}}
     client.game_dict = {}  # Keeps track of the games {{'lobby_name' : Game Object}
     client.move_dict = {}  # Keeps track of the games {{'lobby_name' : Game Object}
+    # Per player token buckets refilled every turn (every tick in tick mode), tune with
+    # MOVE_RATE (moves/turn) and MOVE_BURST
+    client.move_limiter = MoveLimiter(
+        rate=float(os.environ.get("MOVE_RATE", 2)),
+        burst=int(os.environ.get("MOVE_BURST", 4)),
+    )
+
+    # Work for the game thread, see serve
+    client.tasks = queue.SimpleQueue()
+    client.post = lambda function, *args: client.tasks.put((function, args))
+    # PRINT_MAPS=1 prints every board after each turn, a debugging aid, games/<lobby>/spectate streams them
+    client.print_maps = bool(int(os.environ.get("PRINT_MAPS", 0)))
+    # EARLY_FINISH=1 ends a game as soon as its winner is decided instead of at the last coin
+    client.early_finish = bool(int(os.environ.get("EARLY_FINISH", 0)))
+    # Spectator deltas per second for games/<lobby>/spectate, SPECTATE_RATE=0 turns it off
+    client.spectate_rate = float(os.environ.get("SPECTATE_RATE", 5))
+    client.spectators = {}  # {'lobby_name' : SpectatorStream}
+    # SHARED_BOARDS=1 mirrors every board into shared memory for sidecars, see sharedBoard.py
+    client.shared_boards_enabled = bool(int(os.environ.get("SHARED_BOARDS", 0)))
+    client.shared_boards = {}  # {'lobby_name' : SharedBoard}
+    # TEAM_VISION=1 publishes every team's combined view to games/<lobby>/<team>/team_state
+    client.team_vision_enabled = bool(int(os.environ.get("TEAM_VISION", 0)))
+    client.team_visions = {}  # {'lobby_name' : TeamVision}
+    # EXPLORED_IN_STATE=1 adds each player's explored bitmap to its game_state, it can also be requested
+    # on games/<lobby>/<player>/explored
+    client.explored_in_state = bool(int(os.environ.get("EXPLORED_IN_STATE", 0)))
+    # TICK_RATE > 0 resolves moves at that many ticks per second instead of lockstep turns
+    tick_rate = float(os.environ.get("TICK_RATE", 0))
+    client.tick_loop = None
+    if tick_rate > 0:
+        client.tick_loop = TickLoop(tick_rate, lambda: call(client, tick_lobbies, client))
+
+    # One timer wheel drives every lobby's turn deadline, TURN_DEADLINE=0 waits forever
+    client.turn_scheduler = None
+    if turn_deadline_seconds > 0 and client.tick_loop is None:
+        wheel = TimerWheel()
+        client.turn_scheduler = TurnScheduler(
+            wheel,
+            turn_deadline_seconds,
+            lambda lobby_name, turn: client.post(turn_deadline, client, lobby_name, turn),
+        )
+        wheel.start()
+
+    # Records changed lobbies to CHECKPOINT_PATH, set it empty to disable
+    checkpoint_path = os.environ.get("CHECKPOINT_PATH", "lobbies.ckpt")
+    if checkpoint_path and num_shards > 1:
+        checkpoint_path = f"{checkpoint_path}.{shard}"
+    client.checkpointer = None
+    if checkpoint_path:
+        snapshot = load_checkpoint(checkpoint_path)
+        if snapshot is not None:
+            resume_lobbies(client, snapshot)
+        every_turns = int(os.environ.get("CHECKPOINT_EVERY_TURNS", 10))
+        every_seconds = float(os.environ.get("CHECKPOINT_EVERY_SECONDS", 5))
+        if tick_rate > 0:
+            # Every tick is a turn, checkpointing every few of them would write each lobby many times a second
+            every_turns = max(every_turns, int(tick_rate * every_seconds))
+        client.checkpointer = Checkpointer(
+            checkpoint_path,
+            every_turns=every_turns,
+            every_seconds=every_seconds,
+        )
+
+    if client.tick_loop is not None:
+        client.tick_loop.start()
+
+    for topic in client.router.subscriptions(
+        ["new_game", "games/+/start", "games/+/+/move", "games/+/+/explored"]
+    ):
+        client.subscribe(topic)
+    client.subscribe("server/stats")
+    if node_id:
+        client.router.announce(client)
+
+    # paho's network thread only hands messages and acks over, every game change runs on this one
+    client.loop_start()
+    serve(client)
 
-    client.subscribe("new_game")
-    client.subscribe("games/+/start")
-    client.subscribe("games/+/+/move")
 
-    client.loop_forever()
+if __name__ == "__main__":
+    load_dotenv(dotenv_path="../credentials.env")
+
+    # GAME_SHARDS > 1 starts that many worker processes, each owning a share of the lobbies
+    num_shards = int(os.environ.get("GAME_SHARDS", 1))
+    if num_shards == 1:
+        run_server()
+    else:
+        workers = [
+            multiprocessing.Process(target=run_server, args=(shard, num_shards))
+            for shard in range(num_shards)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
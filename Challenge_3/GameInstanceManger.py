@@ -1,64 +1,184 @@
 import os
 import json
+import threading
+from collections import OrderedDict
 
-import paho.mqtt.client as paho
-from paho import mqtt
 from dotenv import load_dotenv
 from pydantic import ValidationError
 
 from InputTypes import NewPlayer, Move
 from game import Game
+from moveset import Moveset
+from sessionClient import SessionClient
 
 
-# Global Variables
-load_dotenv(dotenv_path="./credentials.env")
+class ConnectionPool:
+    def __init__(self, size: int = 2, client_id: str = "GameInstances"):
+        """
+        A few shared broker connections that every game instance publishes and subscribes through
+        :param size: number of connections, each one has its own network thread
+        :param client_id: prefix of the connections' client ids
+        """
+        load_dotenv(dotenv_path="../credentials.env")
+        broker_address = os.environ.get("BROKER_ADDRESS")
+        broker_port = int(os.environ.get("BROKER_PORT"))
+        username = os.environ.get("USER_NAME")
+        password = os.environ.get("PASSWORD")
+        self.lock = threading.Lock()
+        self.clients: list[SessionClient] = []
+        self.handlers: list[dict] = []  # per connection {'topic' : handler}
+        self.lobbies: list[int] = []  # lobbies using each connection
+        for index in range(size):
+            client = SessionClient(f"{client_id}-{index}", userdata=index)
+            # set username and password
+            client.username_pw_set(username, password)
+            # connect to HiveMQ Cloud on port 8883 (default for MQTT)
+            client.connect(broker_address, broker_port)
+            client.on_message = self.on_message
+            client.loop_start()
+            self.clients.append(client)
+            self.handlers.append({})
+            self.lobbies.append(0)
+
+    def acquire(self) -> int:
+        """
+        :return: index of the least used connection, to be given back with release
+        """
+        with self.lock:
+            index = min(range(len(self.clients)), key=lambda i: self.lobbies[i])
+            self.lobbies[index] += 1
+            return index
+
+    def release(self, index: int):
+        with self.lock:
+            self.lobbies[index] -= 1
+
+    def subscribe(self, index: int, topic: str, handler):
+        """
+        Routes messages on topic to handler(msg), called from the connection's network thread
+        """
+        with self.lock:
+            self.handlers[index][topic] = handler
+        self.clients[index].subscribe(topic)
 
-broker_address = os.environ.get("BROKER_ADDRESS")
-broker_port = int(os.environ.get("BROKER_PORT"))
-username = os.environ.get("USERNAME")
-password = os.environ.get("PASSWORD")
+    def unsubscribe(self, index: int, topic: str):
+        with self.lock:
+            self.handlers[index].pop(topic, None)
+        self.clients[index].unsubscribe(topic)
 
+    def publish(self, index: int, topic: str, payload):
+        self.clients[index].publish(topic, payload)
 
-def on_message(self, client, userdata, msg):
-    """
-    Prints a mqtt message to stdout ( used as callback for subscribe )
-    :param client: the client itself
-    :param userdata: userdata is set when initiating the client, here it is userdata=None
-    :param msg: the message with topic and payload
-    """
-    pass
+    def on_message(self, client, userdata, msg):
+        """
+        Dispatches a message to the game instance subscribed to its topic
+        :param client: the connection that received the message
+        :param userdata: index of the connection in the pool
+        :param msg: the message with topic and payload
+        """
+        with self.lock:
+            handler = self.handlers[userdata].get(msg.topic)
+        if handler is not None:
+            handler(msg)
+
+    def close(self):
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
 
 
 class GameInstanceManager:
-    def __init__(self, lobby_name: str, team_dict: dict[str, list[str]]):
+    def __init__(self, lobby_name: str, team_dict: dict[str, list[str]], pool: ConnectionPool):
         """
-        Creates a new client to handle each game
+        Runs a single lobby's game over a connection borrowed from the pool
+        :param lobby_name: lobby the players joined
+        :param team_dict: {'team_name' : [player_name, ...]}
+        :param pool: shared broker connections
         """
-        # initialize new client
-        self.client = paho.Client(
-            client_id=lobby_name, userdata=None, protocol=paho.MQTTv5
-        )
-        # enable TLS for secure connection
-        self.client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
-        # set username and password
-        self.client.username_pw_set(username, password)
-        # connect to HiveMQ Cloud on port 8883 (default for MQTT)
-        self.client.connect(broker_address, broker_port)
-        # handles subscription
-        self.client.on_message = self.on_message
-
-        # subscribes to player movement topics
-        for team in team_dict.keys():
-            for player in team_dict[team]:
-                self.client.subscribe(f"games/{lobby_name}/{player}/move")
+        self.lobby_name = lobby_name
+        self.pool = pool
+        self.connection = pool.acquire()
+        self.game = Game(team_dict)
+        self.moves: OrderedDict[str, Moveset] = OrderedDict()
+        self.topics: list[str] = []
+        self.finished = threading.Event()
 
     def start(self):
-        self.client.loop_start()
+        """
+        Subscribes to the players' move topics and sends everyone their first game state
+        """
+        for player in self.game.all_players.keys():
+            topic = f"games/{self.lobby_name}/{player}/move"
+            self.pool.subscribe(self.connection, topic, self.on_move)
+            self.topics.append(topic)
+        self.publish_states()
+        print(self.game.map)
+
+    def on_move(self, msg):
+        """
+        Records a player's move and resolves the turn once every player has moved
+        :param msg: the message with topic and payload
+        """
+        player_name = msg.topic.split("/")[2]
+        try:
+            move = Move(move=msg.payload.decode())
+        except (ValidationError, UnicodeDecodeError):
+            self.publish_to_lobby(f"Error: Invalid move from {player_name}")
+            return
+        self.moves[player_name] = Moveset[move.move]
+
+        if len(self.moves) == len(self.game.all_players):
+            self.resolve_turn()
+
+    def resolve_turn(self):
+        for player, move in self.moves.items():
+            self.game.movePlayer(player, move)
+        self.moves.clear()
+
+        self.publish_states()
+        print(self.game.map)
+        self.pool.publish(
+            self.connection,
+            f"games/{self.lobby_name}/scores",
+            json.dumps(self.game.getScores()),
+        )
+        if self.game.gameOver():
+            self.publish_to_lobby(f"Game Over: {self.game.gameOverReason()}")
+            self.close()
+
+    def publish_states(self):
+        for player in self.game.all_players.keys():
+            self.pool.publish(
+                self.connection,
+                f"games/{self.lobby_name}/{player}/game_state",
+                json.dumps(self.game.getGameData(player)),
+            )
+
+    def publish_to_lobby(self, msg: str):
+        self.pool.publish(self.connection, f"games/{self.lobby_name}/lobby", msg)
+
+    def close(self):
+        """
+        Unsubscribes from the lobby's topics and gives the connection back, safe to call twice
+        """
+        if self.finished.is_set():
+            return
+        for topic in self.topics:
+            self.pool.unsubscribe(self.connection, topic)
+        self.topics.clear()
+        self.pool.release(self.connection)
+        self.finished.set()
+
+    def __enter__(self):
+        self.start()
+        return self
 
-    def __del__(self):
-        self.client.loop_stop()
-        self.client.disconnect()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 if __name__ == "__main__":
-    game = GameInstanceManager()
+    pool = ConnectionPool()
+    with GameInstanceManager("demo", {"TeamA": ["Alice"], "TeamB": ["Bob"]}, pool) as game:
+        game.finished.wait()
+    pool.close()
@@ -0,0 +1,229 @@
+import time
+import random
+from argparse import ArgumentParser
+
+from AutoPlayerClient import PlayerMap
+from lookahead import LookaheadPlanner
+from endgame import EndgameSolver
+
+
+class SilentObserver:
+    # Stands in for AutoPlayerClient, nothing is published
+    def publish_collected(self, coins):
+        pass
+
+    def publish_coins(self, coins):
+        pass
+
+    def publish_walls(self, walls):
+        pass
+
+    def publish_seen(self, seen):
+        pass
+
+
+def random_board(size: int, seed: int = 0) -> dict:
+    """
+    :return: {(x, y) : 'walls' | 'coin1' | 'coin2' | 'coin3'} with the game's wall and coin ratios
+    """
+    rng = random.Random(seed)
+    board = {}
+    for x in range(size):
+        for y in range(size):
+            roll = rng.random()
+            if roll < 0.2:
+                board[(x, y)] = "walls"
+            elif roll < 0.35:
+                board[(x, y)] = rng.choices(("coin1", "coin2", "coin3"), (6, 3, 1))[0]
+    return board
+
+
+def known_map(board: dict, size: int, coins: bool = True, seen_columns: int = None, **kwargs) -> PlayerMap:
+    """
+    :param coins: also tell the map every coin of board
+    :param seen_columns: columns marked as seen from the left, the whole board by default
+    :return: a PlayerMap knowing every wall of board, kwargs are passed on to PlayerMap
+    """
+    player_map = PlayerMap(SilentObserver(), "bench", size, size, **kwargs)
+    player_map.add_walls(coord for coord, item in board.items() if item == "walls")
+    if coins:
+        player_map.add_coins(
+            [[coord for coord, item in board.items() if item == key] for key in ("coin1", "coin2", "coin3")]
+        )
+    seen_columns = size if seen_columns is None else seen_columns
+    player_map.add_seen([(x, y) for x in range(size) for y in range(seen_columns)])
+    return player_map
+
+
+def sweep(size: int):
+    # Boustrophedon walk, the player ends up having seen the whole board
+    for x in range(0, size, 5):
+        columns = range(size) if (x // 5) % 2 == 0 else range(size - 1, -1, -1)
+        for y in columns:
+            yield x, y
+
+
+def game_state(board: dict, size: int, position: tuple[int, int]) -> dict:
+    state = {
+        "teammateNames": [],
+        "teammatePositions": [],
+        "enemyPositions": [],
+        "currentPosition": list(position),
+        "coin1": [],
+        "coin2": [],
+        "coin3": [],
+        "walls": [],
+    }
+    x, y = position
+    for i in range(max(x - 2, 0), min(x + 3, size)):
+        for j in range(max(y - 2, 0), min(y + 3, size)):
+            item = board.get((i, j))
+            if item is not None:
+                state[item].append([i, j])
+    # The player collects whatever it stands on
+    board.pop(position, None)
+    return state
+
+
+def knowledge(size: int, buckets: int = 10):
+    """
+    Times PlayerMap's per turn knowledge update while a player explores a size x size board,
+    grouped by how much of the board it has seen so far
+    """
+    board = random_board(size)
+    player_map = PlayerMap(SilentObserver(), "bench", size, size)
+    timings = [[] for _ in range(buckets)]
+    for position in sweep(size):
+        state = game_state(board, size, position)
+        started = time.perf_counter()
+        player_map.load_visible_map(state)
+        elapsed = time.perf_counter() - started
+        seen = len(player_map.seen_coords) / (size * size)
+        timings[min(int(seen * buckets), buckets - 1)].append(elapsed)
+
+    print(f"{size}x{size} board, load_visible_map per turn by share of the board seen")
+    for bucket, samples in enumerate(timings):
+        if not samples:
+            continue
+        mean = 1e6 * sum(samples) / len(samples)
+        print(f"  {100 * bucket // buckets:3d}-{100 * (bucket + 1) // buckets:3d}% seen: {mean:9.1f} us ({len(samples)} turns)")
+
+
+def plan(size: int, turns: int = 200):
+    """
+    Times next_move on a size x size board half explored, once with coins in sight
+    and once with none known so every unseen cell is scored. The first pass over
+    the positions fills the distance cache, the second one only reads it
+    """
+    board = random_board(size)
+    rng = random.Random(1)
+    for label, keep_coins in (("coins known", True), ("no coins known", False)):
+        player_map = known_map(board, size, coins=keep_coins, seen_columns=size // 2)
+        free = [(x, y) for x in range(size) for y in range(size) if player_map.map[x][y] == 0]
+        positions = [rng.choice(free) for _ in range(turns)]
+        for cache in ("cold", "warm"):
+            samples = []
+            for position in positions:
+                player_map.current_position = position
+                started = time.perf_counter()
+                player_map.next_move()
+                samples.append(time.perf_counter() - started)
+            samples.sort()
+            mean = 1e6 * sum(samples) / len(samples)
+            print(f"{size}x{size} board, {label:14s} {cache} next_move mean {mean:9.1f} us, p99 {1e6 * samples[int(0.99 * len(samples))]:9.1f} us")
+
+
+def score(size: int, turns: int = 50):
+    """
+    Times next_move on a fully known size x size board, cold with the distance fields of the
+    first steps computed in the turn like after a new wall is found, and warm with them cached
+    """
+    board = random_board(size)
+    player_map = known_map(board, size, seen_columns=size // 2, enemy_penalty=5)
+    player_map.current_position = next(
+        (x, y) for x in range(size // 2, size) for y in range(size // 2, size) if player_map.map[x, y] == 0
+    )
+    player_map.enemies = {(size // 2, size // 3), (size // 3, size // 2)}
+    for label in ("cold", "warm"):
+        samples = []
+        for _ in range(turns):
+            if label == "cold":
+                player_map.distances.fields = {}
+            started = time.perf_counter()
+            player_map.next_move()
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        mean = 1e3 * sum(samples) / len(samples)
+        print(f"{size}x{size} board, {label} next_move mean {mean:7.2f} ms, max {1e3 * samples[-1]:7.2f} ms")
+
+
+def lookahead(size: int, turns: int = 50):
+    """
+    Depth and nodes LookaheadPlanner gets through per turn on a fully known size x size board
+    with two enemies, for a few deadlines. Every deadline starts without distance fields and loads
+    them over its first turns, a BFS under way when the time runs out counts in the overrun
+    """
+    board = random_board(size)
+    player_map = known_map(board, size)
+    free = [(x, y) for x in range(size) for y in range(size) if player_map.map[x, y] == 0]
+    rng = random.Random(2)
+    player_map.enemies = set(rng.sample(free, 2))
+    positions = [rng.choice(free) for _ in range(turns)]
+    for deadline in (0.01, 0.05, 0.2):
+        planner = LookaheadPlanner(deadline=deadline)
+        player_map.distances.fields = {}
+        depths = []
+        overrun = 0.0
+        for position in positions:
+            player_map.current_position = position
+            planner.next_move(player_map)
+            depths.append(planner.last["depth"])
+            overrun = max(overrun, planner.last["ms"] - 1000 * deadline)
+        stats = planner.stats()
+        print(f"{size}x{size} board, deadline {1000 * deadline:5.0f} ms: depth mean {sum(depths) / len(depths):5.1f}, "
+              f"{stats['nodes_mean']:9.0f} nodes, {stats['time_mean_ms']:7.2f} ms per turn, worst overrun {overrun:5.2f} ms")
+
+
+def endgame(size: int, repeats: int = 5):
+    """
+    Times EndgameSolver.solve for a team of three on a fully known size x size board by number
+    of coins left. The first solve of each count builds tables the later ones reuse and is not timed
+    """
+    board = random_board(size)
+    free = [(x, y) for x in range(size) for y in range(size) if (x, y) not in board]
+    rng = random.Random(3)
+    for coins in (4, 8, 10, 12):
+        samples = []
+        for repeat in range(repeats + 1):
+            player_map = known_map(board, size, coins=False)
+            picked = rng.sample(free, coins + 3)
+            for coord in picked[:coins]:
+                getattr(player_map, rng.choice(("coin1", "coin2", "coin3"))).add(coord)
+            player_map.current_position = picked[coins]
+            player_map.teammates = {"mate1": picked[coins + 1], "mate2": picked[coins + 2]}
+            solver = EndgameSolver(max_coins=coins)
+            started = time.perf_counter()
+            solver.next_move(player_map)
+            if repeat:
+                samples.append(time.perf_counter() - started)
+        mean = 1e3 * sum(samples) / len(samples)
+        print(f"{size}x{size} board, {coins:2d} coins: solve mean {mean:7.2f} ms, max {1e3 * max(samples):7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="PlayerMap benchmarks")
+    parser.add_argument("benchmark", choices=("knowledge", "plan", "score", "lookahead", "endgame"))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        if args.benchmark == "knowledge":
+            knowledge(size)
+        elif args.benchmark == "plan":
+            plan(size)
+        elif args.benchmark == "score":
+            score(size)
+        elif args.benchmark == "lookahead":
+            lookahead(size)
+        elif args.benchmark == "endgame":
+            endgame(size)
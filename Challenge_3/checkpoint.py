@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import zlib
+import threading
+from collections import OrderedDict
+
+from game import Game
+from moveset import Moveset
+
+
+def snapshot_lobby(client, lobby_name: str) -> dict:
+    """
+    Captures one lobby's roster, game and pending moves
+    :param client: the game server client holding team_dict, game_dict and move_dict
+    :return: json serializable snapshot
+    """
+    teams = client.team_dict[lobby_name]
+    game = client.game_dict.get(lobby_name)
+    moves = client.move_dict.get(lobby_name, {})
+    return {
+        "teams": {
+            key: list(value) if isinstance(value, list) else value
+            for key, value in teams.items()
+        },
+        "game": game.toDict() if game is not None else None,
+        "moves": [(player, move.name) for player, move in moves.values()],
+    }
+
+
+def restore_lobby(client, lobby_name: str, lobby: dict) -> bool:
+    """
+    Loads a snapshot made by snapshot_lobby back into the client dictionaries
+    :return: True if the lobby has a running game
+    """
+    client.team_dict[lobby_name] = lobby["teams"]
+    if lobby["game"] is None:
+        return False
+    client.game_dict[lobby_name] = Game.fromDict(lobby["game"])
+    client.move_dict[lobby_name] = OrderedDict(
+        (player, (player, Moveset[move])) for player, move in lobby["moves"]
+    )
+    return True
+
+
+def restore_lobbies(client, snapshot: dict):
+    """
+    Loads a snapshot made by load_checkpoint back into the client dictionaries
+    :return: names of the lobbies with a running game
+    """
+    return [
+        lobby_name
+        for lobby_name, lobby in snapshot["lobbies"].items()
+        if restore_lobby(client, lobby_name, lobby)
+    ]
+
+
+def encode_record(lobby_name: str, lobby) -> bytes:
+    """
+    :param lobby: snapshot_lobby of the lobby, None once it is gone
+    :return: one checkpoint line, the crc32 of the body in hex followed by the body
+    """
+    body = json.dumps({"time": time.time(), "lobby": lobby_name, "state": lobby}, separators=(",", ":")).encode()
+    return b"%08x %s\n" % (zlib.crc32(body), body)
+
+
+def load_checkpoint(path: str):
+    """
+    Replays the intact per-lobby records of a checkpoint file, the newest record of a lobby wins,
+    a record without state removes its lobby and a torn last write is ignored
+    :return: {'time': ..., 'lobbies': {'lobby_name' : snapshot_lobby}} or None if there is nothing usable
+    """
+    if not os.path.exists(path):
+        return None
+    lobbies = {}
+    latest = None
+    with open(path, "rb") as f:
+        for line in f:
+            checksum, _, body = line.rstrip(b"\n").partition(b" ")
+            try:
+                if int(checksum, 16) != zlib.crc32(body):
+                    continue
+                record = json.loads(body)
+            except ValueError:
+                continue
+            latest = record["time"]
+            if record["state"] is None:
+                lobbies.pop(record["lobby"], None)
+            else:
+                lobbies[record["lobby"]] = record["state"]
+    if latest is None:
+        return None
+    return {"time": latest, "lobbies": lobbies}
+
+
+class Checkpointer:
+    def __init__(self, path: str, every_turns: int = 10, every_seconds: float = 5.0, max_bytes: int = 4 << 20):
+        """
+        Appends one record per changed lobby to a file from a background thread
+        :param path: append-only checkpoint file
+        :param every_turns: resolved turns of a lobby between two of its checkpoints
+        :param every_seconds: longest time a resolved turn may wait for a checkpoint
+        :param max_bytes: file size after which it is compacted down to the newest record of each lobby
+        """
+        self.path = path
+        self.every_turns = every_turns
+        self.every_seconds = every_seconds
+        self.max_bytes = max_bytes
+        self.turns: dict[str, int] = {}  # {'lobby_name' : turns resolved since its last checkpoint}
+        self.last: dict[str, float] = {}  # {'lobby_name' : time of its last checkpoint}
+        self.written = 0
+        self.__terminate_torn_record()
+        # Newest record of every lobby, all that is kept when the file is compacted
+        existing = load_checkpoint(path)
+        self.records: dict[str, bytes] = {
+            lobby_name: encode_record(lobby_name, lobby)
+            for lobby_name, lobby in (existing["lobbies"] if existing else {}).items()
+        }
+        # Only the newest snapshot of a lobby is worth writing, older ones are replaced while waiting
+        self.pending: dict[str, dict] = {}
+        self.pending_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name="checkpointer", daemon=True)
+        self.thread.start()
+
+    def turn_finished(self, client, lobby_name: str):
+        """
+        Checkpoints the lobby once enough of its turns or enough time have passed since its last checkpoint
+        """
+        now = time.monotonic()
+        self.turns[lobby_name] = self.turns.get(lobby_name, 0) + 1
+        last = self.last.setdefault(lobby_name, now)
+        if self.turns[lobby_name] >= self.every_turns or now - last >= self.every_seconds:
+            self.capture(client, lobby_name)
+
+    def capture(self, client, lobby_name: str):
+        """
+        Takes a snapshot of one lobby on the calling thread, or notes that it is gone,
+        and leaves encoding and disk writes to the background thread
+        """
+        lobby = snapshot_lobby(client, lobby_name) if lobby_name in client.team_dict else None
+        if lobby is None:
+            self.turns.pop(lobby_name, None)
+            self.last.pop(lobby_name, None)
+        else:
+            self.turns[lobby_name] = 0
+            self.last[lobby_name] = time.monotonic()
+        with self.pending_lock:
+            self.pending[lobby_name] = lobby
+        self.wakeup.set()
+
+    def stats(self) -> dict:
+        return {"written": self.written, "lobbies": len(self.records), "pending": len(self.pending)}
+
+    def __run(self):
+        while True:
+            self.wakeup.wait()
+            with self.pending_lock:
+                pending, self.pending = self.pending, {}
+                self.wakeup.clear()
+            records = []
+            for lobby_name, lobby in pending.items():
+                record = encode_record(lobby_name, lobby)
+                records.append(record)
+                if lobby is None:
+                    self.records.pop(lobby_name, None)
+                else:
+                    self.records[lobby_name] = record
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    self.__write(self.path + ".tmp", b"".join(self.records.values()), "wb")
+                    os.replace(self.path + ".tmp", self.path)
+                else:
+                    self.__write(self.path, b"".join(records), "ab")
+                self.written += len(records)
+            except OSError as e:
+                print(f"Checkpoint failed: {e}")
+
+    def __terminate_torn_record(self):
+        # A crash mid-write leaves a partial line, close it so the next record starts clean
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    @staticmethod
+    def __write(path: str, record: bytes, mode: str):
+        with open(path, mode) as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,69 @@
+from array import array
+
+import numpy as np
+
+UNREACHABLE = 0xFFFF
+
+
+class DistanceCache:
+    def __init__(self, rows: int, columns: int):
+        """
+        Wall only shortest path distances, one BFS field per source cell computed on first use
+        and kept until a new wall is found. Unknown cells count as open like in next_move
+        """
+        self.rows = rows
+        self.columns = columns
+        self.walls: set[tuple[int, int]] = set()
+        self.fields: dict[int, array] = {}
+        self.computed = 0
+        # Open cells with a closed border around the board, so the BFS needs no bounds checks
+        self.width = columns + 2
+        self.open = np.zeros((rows + 2) * self.width, dtype=bool)
+        self.open.reshape(rows + 2, self.width)[1:-1, 1:-1] = True
+        self.steps = np.array([-1, 1, -self.width, self.width])
+
+    def add_walls(self, walls: list[tuple[int, int]]):
+        """
+        :param walls: newly found walls, the fields are dropped if one of them is on the board
+        """
+        new_walls = [
+            wall for wall in walls
+            if 0 <= wall[0] < self.rows and 0 <= wall[1] < self.columns and wall not in self.walls
+        ]
+        if not new_walls:
+            return
+        self.walls.update(new_walls)
+        for x, y in new_walls:
+            self.open[(x + 1) * self.width + y + 1] = False
+        self.fields = {}
+
+    def distance(self, source: tuple[int, int], target: tuple[int, int]) -> int:
+        return self.field(source)[target[0] * self.columns + target[1]]
+
+    def field(self, source: tuple[int, int]) -> array:
+        """
+        :return: distance from source to every cell indexed x * columns + y, UNREACHABLE where walled off
+        """
+        index = source[0] * self.columns + source[1]
+        field = self.fields.get(index)
+        if field is None:
+            field = self.__bfs(source)
+            self.fields[index] = field
+            self.computed += 1
+        return field
+
+    def __bfs(self, source: tuple[int, int]) -> array:
+        # Expands the whole frontier one step at a time with numpy, on the bordered board
+        field = np.full(self.open.size, UNREACHABLE, dtype=np.uint16)
+        start = (source[0] + 1) * self.width + source[1] + 1
+        if self.open[start]:
+            field[start] = 0
+            frontier = np.array([start])
+            step = 0
+            while frontier.size:
+                step += 1
+                reached = (frontier[:, None] + self.steps).ravel()
+                reached = reached[self.open[reached] & (field[reached] == UNREACHABLE)]
+                field[reached] = step
+                frontier = np.unique(reached)
+        return array("H", field.reshape(-1, self.width)[1:-1, 1:-1].tobytes())
@@ -0,0 +1,191 @@
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from distanceCache import UNREACHABLE
+
+MOVES = (((0, -1), "LEFT"), ((0, 1), "RIGHT"), ((-1, 0), "UP"), ((1, 0), "DOWN"))
+INFINITY = 1 << 40
+
+
+@lru_cache(maxsize=None)
+def layers(n: int) -> list[np.ndarray]:
+    """
+    :return: every mask of n bits grouped by how many bits are set, index k holds the masks with k bits
+    """
+    masks = np.arange(1 << n)
+    counts = np.zeros(1 << n, dtype=np.int64)
+    for bit in range(n):
+        counts += (masks >> bit) & 1
+    return [masks[counts == k] for k in range(n + 1)]
+
+
+@lru_cache(maxsize=None)
+def submask_pairs(n: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The submasks of every mask are walked together with s = (s - 1) & mask, so only
+    the 3^n pairs that exist are ever built
+    :return: (masks, submasks, starts), every (mask, submask) pair of n bits grouped by mask,
+    starts[mask] is where the pairs of mask begin
+    """
+    full = np.arange(1 << n)
+    sizes = np.ones(1 << n, dtype=np.int64)
+    for bit in range(n):
+        sizes <<= (full >> bit) & 1
+    starts = np.cumsum(sizes) - sizes
+    masks = np.repeat(full, sizes)
+    submasks = np.empty(len(masks), dtype=np.int64)
+    active, current = full, full
+    for k in range(1 << n):
+        submasks[starts[active] + k] = current
+        more = current != 0
+        active = active[more]
+        current = (current[more] - 1) & active
+    return masks, submasks, starts
+
+
+def value_sums(values: list[int]) -> np.ndarray:
+    """
+    :return: total value of the coins of every mask
+    """
+    masks = np.arange(1 << len(values))
+    sums = np.zeros(1 << len(values), dtype=np.int64)
+    for j, value in enumerate(values):
+        sums += ((masks >> j) & 1) * value
+    return sums
+
+
+def held_karp(sums: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """
+    Built backwards so the cost is known without the walk's start: putting coin i in front
+    of a walk through mask delays every coin of mask by distances[i, first]
+    :param sums: value_sums of the coins
+    :param distances: distance between each pair of coins
+    :return: dp[mask, first], the least sum of value * moves until collected over the coins of mask
+    for a walk starting on coin first at move 0
+    """
+    n = len(distances)
+    bits = 1 << np.arange(n)
+    dp = np.full((1 << n, n), INFINITY, dtype=np.int64)
+    dp[bits, np.arange(n)] = 0
+    for masks in layers(n)[1:n]:
+        # cheapest walk through each mask of this size after first moving from every coin
+        reach = (dp[masks][:, None, :] + distances[None] * sums[masks][:, None, None]).min(axis=2)
+        for i in range(n):
+            free = (masks & bits[i]) == 0
+            targets = masks[free] | bits[i]
+            dp[targets, i] = np.minimum(dp[targets, i], reach[free, i])
+    return dp
+
+
+class EndgameSolver:
+    def __init__(self, max_coins: int = 12):
+        """
+        Once the team has seen the whole board and at most max_coins coins are left, splits them among
+        the team and orders each share so the least value waits the fewest moves, summed over value * moves
+        until collected. The plan is only solved again when the set of coins changes
+        :param max_coins: the solver takes O(3^n) memory and time in the number of coins
+        """
+        self.max_coins = max_coins
+        self.key: frozenset = None
+        self.route: list[tuple[int, int]] = []  # our coins in collection order
+        self.cost = 0
+        self.solves = 0
+        self.last_ms = 0.0
+
+    def active(self, player_map) -> bool:
+        coins = len(player_map.coin1) + len(player_map.coin2) + len(player_map.coin3)
+        return 0 < coins <= self.max_coins and not player_map.unseen.any()
+
+    def next_move(self, player_map):
+        """
+        :return: (direction, next_coords) like PlayerMap.next_move, None outside the endgame,
+        when our share is empty or when our next step is blocked
+        """
+        if not self.active(player_map):
+            self.key = None
+            return None
+        key = frozenset(player_map.coin1 | player_map.coin2 | player_map.coin3)
+        if key != self.key:
+            started = time.perf_counter()
+            self.key = key
+            self.solve(player_map)
+            self.solves += 1
+            self.last_ms = 1000 * (time.perf_counter() - started)
+        if not self.route:
+            return None
+
+        field = player_map.distances.field(self.route[0])
+        x, y = player_map.current_position
+        here = field[x * player_map.columns + y]
+        for (dx, dy), direction in MOVES:
+            nx, ny = x + dx, y + dy
+            if not (0 <= nx < player_map.rows and 0 <= ny < player_map.columns):
+                continue
+            if player_map.map[nx, ny] != -1 and field[nx * player_map.columns + ny] < here:
+                return direction, [nx, ny]
+        return None
+
+    def solve(self, player_map):
+        columns = player_map.columns
+        coins = [
+            (coord, value)
+            for value, store in enumerate((player_map.coin1, player_map.coin2, player_map.coin3), start=1)
+            for coord in sorted(store)
+        ]
+        # Everyone plans with the same player order so teammates agree on the split
+        players = sorted({**player_map.teammates, player_map.player_name: player_map.current_position}.items())
+        fields = [player_map.distances.field(coord) for coord, _ in coins]
+        starts = np.array(
+            [[field[loc[0] * columns + loc[1]] for field in fields] for _, loc in players], dtype=np.int64
+        )
+        # Coins walled off from the whole team are left out
+        reachable = (starts != UNREACHABLE).any(axis=0)
+        coins = [coin for coin, keep in zip(coins, reachable) if keep]
+        fields = [field for field, keep in zip(fields, reachable) if keep]
+        starts = starts[:, reachable]
+        if not coins:
+            self.route = []
+            return
+        indices = [coord[0] * columns + coord[1] for coord, _ in coins]
+        distances = np.array([[field[index] for index in indices] for field in fields], dtype=np.int64)
+
+        n = len(coins)
+        sums = value_sums([value for _, value in coins])
+        dp = held_karp(sums, distances)
+        # costs[k][mask]: player k walking to the best first coin, which delays all of mask, then on
+        walks = [dp + start[None, :] * sums[:, None] for start in starts]
+        costs = [walk.min(axis=1) for walk in walks]
+        for cost in costs:
+            cost[0] = 0
+
+        # totals[k][mask]: the least cost of the first k + 1 players collecting mask between them
+        masks, submasks, offsets = submask_pairs(n)
+        totals = [costs[0]]
+        for cost in costs[1:]:
+            totals.append(np.minimum.reduceat(totals[-1][masks ^ submasks] + cost[submasks], offsets))
+
+        mask = (1 << n) - 1
+        self.cost = int(totals[-1][mask])
+        shares = [0] * len(players)
+        for k in range(len(players) - 1, 0, -1):
+            candidates = submasks[offsets[mask]:offsets[mask] + (1 << bin(mask).count("1"))]
+            shares[k] = int(candidates[np.argmin(totals[k - 1][mask ^ candidates] + costs[k][candidates])])
+            mask ^= shares[k]
+        shares[0] = mask
+
+        me = [name for name, _ in players].index(player_map.player_name)
+        share = shares[me]
+        if not share:
+            self.route = []
+            return
+        order = [int(np.argmin(walks[me][share]))]
+        rest = share ^ (1 << order[0])
+        while rest:
+            # the coin after first is the one the rest of the best walk starts on
+            first = order[-1]
+            nexts = dp[rest] + distances[first] * sums[rest]
+            order.append(int(np.argmin(nexts)))
+            rest ^= 1 << order[-1]
+        self.route = [coins[j][0] for j in order]
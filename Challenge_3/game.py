@@ -7,20 +7,94 @@ from moveset import Moveset
 from player import Player
 from team import Team
 from gameItems import *
+from gameEvents import PlayerMoved, CoinCollected, MoveBlocked, GameOver
+from zobrist import scoreKey, formatHash
 import random
+import base64
+from typing import Optional
 
 class Game:
-    def __init__(self, playerNames: dict[str,list[str]], width: int = 10, height: int = 10):
+    def __init__(self, playerNames: dict[str,list[str]], width: int = 10, height: int = 10, earlyFinish: bool = False):
         """
         :param playerNames: Dictionary for each team name with a list of player names
+        :param earlyFinish: also end the game once no team can catch up with the leader
         """
         self.numTeams = len(playerNames)
+        self.earlyFinish = earlyFinish
 
         self.teams, self.all_players = self.__initializePlayers(playerNames)
 
         self.__height = height
         self.__width = width
         self.map = Map(height, width, list(self.all_players.values()))
+        self.__observers = []
+        self.__scoreHash = self.__fullScoreHash()
+        # Cells each player has had in view, bit x*width+y, filled in by getGameData
+        self.__explored = {playerName: 0 for playerName in self.all_players}
+
+    def addObserver(self, observer):
+        """
+        :param observer: called with every PlayerMoved, CoinCollected, MoveBlocked and GameOver event
+        """
+        self.__observers.append(observer)
+
+    def removeObserver(self, observer):
+        self.__observers.remove(observer)
+
+    def __emit(self, event):
+        for observer in self.__observers:
+            observer(event)
+
+    @property
+    def stateHash(self) -> int:
+        """
+        64-bit Zobrist hash of the board and the scores, equal states always hash the same
+        """
+        return self.map.hash ^ self.__scoreHash
+
+    def __fullScoreHash(self) -> int:
+        value = 0
+        for teamIndex, team in enumerate(self.teams.values()):
+            value ^= scoreKey(teamIndex, team.score)
+        return value
+
+    def toDict(self) -> dict:
+        """
+        :return: json serializable snapshot of the whole game, see fromDict
+        """
+        return {'height': self.__height,
+                'width': self.__width,
+                'teams': {teamName: {'score': team.score,
+                                     'players': [name for name, player in self.all_players.items()
+                                                 if player.team is team]}
+                          for teamName, team in self.teams.items()},
+                'earlyFinish': self.earlyFinish,
+                'locations': {name: player.loc for name, player in self.all_players.items()},
+                'explored': {name: f'{bits:x}' for name, bits in self.__explored.items()},
+                'map': self.map.toDict()}
+
+    @classmethod
+    def fromDict(cls, data: dict):
+        """
+        Rebuilds a game saved with toDict without placing anything randomly
+        """
+        game = cls.__new__(cls)
+        playerNames = {teamName: team['players'] for teamName, team in data['teams'].items()}
+        game.numTeams = len(playerNames)
+        game.earlyFinish = data.get('earlyFinish', False)
+        game.teams, game.all_players = game.__initializePlayers(playerNames)
+        for teamName, team in data['teams'].items():
+            game.teams[teamName].increaseScore(team['score'])
+        for name, loc in data['locations'].items():
+            game.all_players[name].loc = tuple(loc)
+        game.__height = data['height']
+        game.__width = data['width']
+        game.map = Map.fromDict(data['map'], list(game.all_players.values()))
+        game.__observers = []
+        game.__scoreHash = game.__fullScoreHash()
+        explored = data.get('explored', {})
+        game.__explored = {name: int(explored.get(name, '0'), 16) for name in game.all_players}
+        return game
 
     def __initializePlayers(self, playerNames: dict[str,list[str]]):
         teams = {}
@@ -40,21 +114,39 @@ class Game:
         dx, dy = move.value
         new_loc = x+dx, y+dy
 
+        # Events are only built when someone is listening
+        observed = bool(self.__observers)
+
         if not (0 <= new_loc[0] < self.__height) or not (0 <= new_loc[1] < self.__width):
+            if observed:
+                self.__emit(MoveBlocked(player, new_loc, None))
             return
 
         cell = self.map.get(new_loc)
         if isinstance(cell, Player) or isinstance(cell, Wall):
+            if observed:
+                self.__emit(MoveBlocked(player, new_loc, cell))
             return
 
-        if isinstance(cell, Coin):
-            player.team.increaseScore(cell.value)
-            self.map.decreaseCoin()
-
+        old_loc = player.loc
         self.map.set(player.loc, None)
         self.map.set(new_loc, player)
         player.loc = new_loc
 
+        if isinstance(cell, Coin):
+            team = player.team
+            teamIndex = list(self.teams).index(team.name)
+            self.__scoreHash ^= scoreKey(teamIndex, team.score)
+            team.increaseScore(cell.value)
+            self.__scoreHash ^= scoreKey(teamIndex, team.score)
+            if observed:
+                self.__emit(CoinCollected(player, new_loc, cell.value))
+
+        if observed:
+            self.__emit(PlayerMoved(player, old_loc, new_loc))
+            if isinstance(cell, Coin) and self.gameOver():
+                self.__emit(GameOver(self.getScores()))
+
     def getPlayer(self, playerName: str) -> Player:
         assert isinstance(playerName, str)
         try:
@@ -62,10 +154,39 @@ class Game:
         except KeyError:
             raise KeyError(f'{playerName} is not a valid player name')
 
-    def getGameData(self, playerName:str, visionRadius: int = 2) -> dict:
+    def exploredBitmap(self, playerName: str, team: bool = False) -> int:
+        """
+        :param team: cells explored by any member of the player's team instead
+        :return: bit x*width+y is set for every cell that has been in view
+        """
+        player = self.getPlayer(playerName)
+        if not team:
+            return self.__explored[playerName]
+        bits = 0
+        for name, other in self.all_players.items():
+            if other.team is player.team:
+                bits |= self.__explored[name]
+        return bits
+
+    def exploredData(self, playerName: str, team: bool = False) -> str:
+        """
+        :return: exploredBitmap as base64 of its little endian bytes, bit i is bit i % 8 of byte i // 8
+        """
+        bits = self.exploredBitmap(playerName, team)
+        return base64.b64encode(bits.to_bytes((self.__height * self.__width + 7) // 8, 'little')).decode()
+
+    def __markExplored(self, playerName: str, minX: int, maxX: int, minY: int, maxY: int):
+        row = ((1 << (maxY - minY + 1)) - 1) << minY
+        bits = 0
+        for x in range(minX, maxX + 1):
+            bits |= row << (x * self.__width)
+        self.__explored[playerName] |= bits
+
+    def getGameData(self, playerName:str, visionRadius: int = 2, explored: bool = False) -> dict:
         """
         :param playerName:
         :param vision:
+        :param explored: add the player's explored cells, see exploredData
         :return: {
             teammateNames: [],
             teammatePositions: [(x,y),...],
@@ -74,7 +195,9 @@ class Game:
             coin1: [(x,y),...],
             coin2: [(x,y),...],
             coin3: [(x,y),...],
-            walls: [(x,y),...]
+            walls: [(x,y),...],
+            stateHash: hex string of the full game's hash, see stateHash,
+            explored: only with explored=True, see exploredData
         }
         """
         assert isinstance(playerName, str)
@@ -92,13 +215,17 @@ class Game:
                     'coin1': [],
                     'coin2': [],
                     'coin3': [],
-                    'walls': []}
+                    'walls': [],
+                    'stateHash': formatHash(self.stateHash)}
 
         for x in range(minX, maxX+1):
             for y in range(minY, maxY+1):
                 cell = self.map.get((x,y))
                 self.__addGameData(gameData, cell, (x,y), player)
 
+        self.__markExplored(playerName, minX, maxX, minY, maxY)
+        if explored:
+            gameData['explored'] = self.exploredData(playerName)
         return gameData
 
     def __addGameData(self, gameData: dict, cell: object, loc: tuple[int, int], player: Player):
@@ -118,7 +245,21 @@ class Game:
             gameData['walls'].append(loc)
     
     def gameOver(self):
-        return self.map.numCoins <= 0
+        return self.gameOverReason() is not None
+
+    def gameOverReason(self) -> Optional[str]:
+        """
+        :return: why the game is over, None while it goes on
+        """
+        if self.map.numCoins <= 0:
+            return 'All coins have been collected'
+        if self.earlyFinish and self.numTeams > 1:
+            scores = sorted(self.teams.values(), key=lambda team: team.score, reverse=True)
+            leader, runnerUp = scores[0], scores[1]
+            # Strictly ahead, a possible tie keeps the game going
+            if runnerUp.score + self.map.coinValue < leader.score:
+                return f'{leader.name} can no longer be caught'
+        return None
 
     def getScores(self):
         scores = {}
@@ -0,0 +1,35 @@
+"""
+Events emitted by Game to its observers, see Game.addObserver
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from player import Player
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerMoved:
+    player: Player
+    origin: tuple[int, int]
+    target: tuple[int, int]
+
+
+@dataclass(frozen=True, slots=True)
+class CoinCollected:
+    player: Player
+    loc: tuple[int, int]
+    value: int
+
+
+@dataclass(frozen=True, slots=True)
+class MoveBlocked:
+    player: Player
+    target: tuple[int, int]
+    blocker: object  # Wall, Player or None when the target is off the map
+
+
+@dataclass(frozen=True, slots=True)
+class GameOver:
+    scores: dict[str, int]
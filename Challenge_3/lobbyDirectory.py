@@ -0,0 +1,269 @@
+import json
+import time
+import bisect
+import hashlib
+import threading
+
+from sharding import lobby_of
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: list[str] = (), replicas: int = 64):
+        """
+        Consistent hash ring, adding or removing a node only moves the lobbies in its ranges
+        :param nodes: initial node ids
+        :param replicas: virtual points per node, more points spread lobbies more evenly
+        """
+        self.replicas = replicas
+        self.points: list[int] = []
+        self.owners: list[str] = []
+        self.nodes: set[str] = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = ring_hash(f"{node}#{replica}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def owner(self, lobby_name: str):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, ring_hash(lobby_name)) % len(self.points)
+        return self.owners[index]
+
+
+class LobbyDirectory:
+    def __init__(self, node_id: str, attach, detach, replay, max_pause: float = None,
+                 handoff_timeout: float = 5.0):
+        """
+        Lobby ownership across game server nodes with live handoff of running lobbies,
+        used in place of ShardRouter when servers join and leave at runtime
+        :param node_id: id of this node, also its forwarding topic prefix
+        :param attach: attach(client, lobby_name, snapshot) installs a lobby received from another node
+        :param detach: detach(client, lobby_name) -> snapshot removes a lobby leaving this node
+        :param replay: replay(client, topic_list, msg_payload) dispatches a message held during a handoff
+        :param max_pause: pause above which a handoff is reported as slower than a turn
+        :param handoff_timeout: seconds to wait for the new owner before taking a lobby back
+        """
+        self.shard = node_id
+        self.ring = HashRing([node_id])
+        self.attach = attach
+        self.detach = detach
+        self.replay = replay
+        self.max_pause = max_pause
+        self.handoff_timeout = handoff_timeout
+        self.leaving: dict[str, dict] = {}  # lobbies handed off, waiting for the ack
+        self.arriving: dict[str, list] = {}  # messages for lobbies not received yet
+        # {'lobby_name' : node} for lobbies kept by their old node after a failed handoff, known to every node
+        self.pinned: dict[str, str] = {}
+        self.changed = 0.0
+        self.forwarded = 0
+        self.pauses: list[float] = []
+        self.slow_handoffs = 0
+
+    def subscriptions(self, topics: list[str]) -> list[str]:
+        return [f"$share/gameservers/{topic}" for topic in topics] + [
+            f"shards/{self.shard}/#",
+            "servers/nodes/+",
+            f"servers/{self.shard}/handoff",
+            f"servers/{self.shard}/handoff_ack",
+            "servers/pins",
+        ]
+
+    def announce(self, client):
+        """
+        Joins the ring, the retained empty will set by will_topic removes this node when it drops
+        """
+        client.publish(self.will_topic(), "up", qos=1, retain=True)
+
+    def will_topic(self) -> str:
+        return f"servers/nodes/{self.shard}"
+
+    def local_topic(self, topic_list: list[str]) -> list[str]:
+        if topic_list[0] == "shards" and len(topic_list) > 2:
+            return topic_list[2:]
+        return topic_list
+
+    def owner(self, lobby_name: str) -> str:
+        if lobby_name in self.pinned:
+            return self.pinned[lobby_name]
+        return self.ring.owner(lobby_name)
+
+    def intercept(self, client, topic_list: list[str], msg_payload: bytes) -> bool:
+        """
+        Handles directory traffic and routes lobby messages to the node owning them
+        :return: True if the message must not be dispatched here
+        """
+        if topic_list[0] == "servers":
+            self.__control(client, topic_list, msg_payload)
+            return True
+
+        lobby_name = lobby_of(topic_list, msg_payload)
+        if lobby_name is None:
+            return False
+
+        if lobby_name in self.leaving:
+            # Frozen for the handoff, delivered to the new owner once it has the lobby
+            self.leaving[lobby_name]["held"].append((topic_list, msg_payload))
+            return True
+
+        owner = self.owner(lobby_name)
+        if owner != self.shard:
+            self.forward(client, owner, topic_list, msg_payload)
+            return True
+
+        if (
+            lobby_name not in client.team_dict
+            and topic_list[-1] != "new_game"
+            and time.monotonic() - self.changed < self.handoff_timeout
+        ):
+            # Ours since the last ring change, but its state is still on the way
+            if lobby_name not in self.arriving:
+                self.arriving[lobby_name] = []
+                timer = threading.Timer(self.handoff_timeout, client.post, (self.__abandon, client, lobby_name))
+                timer.daemon = True
+                timer.start()
+            self.arriving[lobby_name].append((topic_list, msg_payload))
+            return True
+        return False
+
+    def forward(self, client, owner: str, topic_list: list[str], msg_payload: bytes):
+        # Straight to the client like ShardRouter.forward, the outbound queue would drop moves past its depth
+        self.forwarded += 1
+        client.publish(f"shards/{owner}/" + "/".join(topic_list), msg_payload, qos=1)
+
+    def rebalance(self, client):
+        """
+        Hands every local lobby whose range moved to another node over to that node
+        """
+        self.changed = time.monotonic()
+        for lobby_name in list(client.team_dict.keys()):
+            owner = self.owner(lobby_name)
+            if owner != self.shard and lobby_name not in self.leaving:
+                self.__hand_off(client, lobby_name, owner)
+
+    def stats(self) -> dict:
+        return {
+            "node": self.shard,
+            "nodes": sorted(self.ring.nodes),
+            "forwarded": self.forwarded,
+            "handoffs": len(self.pauses),
+            "pause_max_ms": 1000 * max(self.pauses, default=0),
+            "pause_last_ms": 1000 * self.pauses[-1] if self.pauses else 0,
+            "slow_handoffs": self.slow_handoffs,
+            "leaving": len(self.leaving),
+        }
+
+    def __control(self, client, topic_list: list[str], msg_payload: bytes):
+        if topic_list[1] == "nodes":
+            node = topic_list[2]
+            if node == self.shard:
+                return
+            if msg_payload:
+                self.ring.add(node)
+            else:
+                self.ring.remove(node)
+            self.pinned.clear()
+            self.rebalance(client)
+        elif topic_list[-1] == "pins":
+            self.__pinned(client, json.loads(msg_payload))
+        elif topic_list[-1] == "handoff":
+            self.__receive(client, json.loads(msg_payload))
+        elif topic_list[-1] == "handoff_ack":
+            self.__acknowledged(client, json.loads(msg_payload))
+
+    def __hand_off(self, client, lobby_name: str, owner: str):
+        started = time.monotonic()
+        snapshot = self.detach(client, lobby_name)
+        self.leaving[lobby_name] = {"to": owner, "started": started, "held": [], "snapshot": snapshot}
+        # Handoffs and acks of many lobbies share a topic, they bypass the outbound queue like forwards
+        client.publish(
+            f"servers/{owner}/handoff",
+            json.dumps({"lobby": lobby_name, "from": self.shard, "state": snapshot}),
+            qos=1,
+        )
+        # Fires on its own thread, the expiry itself runs on the game thread like everything else
+        timer = threading.Timer(self.handoff_timeout, client.post, (self.__expire, client, lobby_name, started))
+        timer.daemon = True
+        timer.start()
+
+    def __receive(self, client, handoff: dict):
+        lobby_name = handoff["lobby"]
+        if self.pinned.get(lobby_name, self.shard) != self.shard:
+            # Came after the old node timed out and kept the lobby
+            return
+        self.attach(client, lobby_name, handoff["state"])
+        for topic_list, msg_payload in self.arriving.pop(lobby_name, []):
+            self.replay(client, topic_list, msg_payload)
+        client.publish(
+            f"servers/{handoff['from']}/handoff_ack",
+            json.dumps({"lobby": lobby_name, "to": self.shard}),
+            qos=1,
+        )
+
+    def __acknowledged(self, client, ack: dict):
+        leaving = self.leaving.pop(ack["lobby"], None)
+        if leaving is None:
+            return
+        pause = time.monotonic() - leaving["started"]
+        self.pauses = self.pauses[-99:] + [pause]
+        if self.max_pause is not None and pause > self.max_pause:
+            self.slow_handoffs += 1
+            print(f"Handoff of {ack['lobby']} paused it for {1000 * pause:.0f} ms, longer than a turn")
+        for topic_list, msg_payload in leaving["held"]:
+            self.forward(client, ack["to"], topic_list, msg_payload)
+
+    def __expire(self, client, lobby_name: str, started: float):
+        # No ack in time, take the lobby back rather than lose it
+        leaving = self.leaving.get(lobby_name)
+        if leaving is None or leaving["started"] != started:
+            return
+        del self.leaving[lobby_name]
+        self.pinned[lobby_name] = self.shard
+        self.attach(client, lobby_name, leaving["snapshot"])
+        for topic_list, msg_payload in leaving["held"]:
+            self.replay(client, topic_list, msg_payload)
+        # Every node, the intended owner too, routes the lobby here until the ring changes again
+        client.publish("servers/pins", json.dumps({"lobby": lobby_name, "node": self.shard}), qos=1)
+        print(f"Handoff of {lobby_name} to {leaving['to']} timed out, kept it here")
+
+    def __pinned(self, client, pin: dict):
+        lobby_name, node = pin["lobby"], pin["node"]
+        if node == self.shard:
+            return
+        self.pinned[lobby_name] = node
+        if lobby_name in client.team_dict:
+            # The handoff arrived after its timeout, the old node kept the lobby and ours is a stale copy
+            self.detach(client, lobby_name)
+        for topic_list, msg_payload in self.arriving.pop(lobby_name, []):
+            self.forward(client, node, topic_list, msg_payload)
+
+    def __abandon(self, client, lobby_name: str):
+        # The lobby's state never came, pass its messages on rather than answer them without the lobby
+        held = self.arriving.pop(lobby_name, None)
+        if not held:
+            return
+        owner = self.owner(lobby_name)
+        if owner != self.shard:
+            for topic_list, msg_payload in held:
+                self.forward(client, owner, topic_list, msg_payload)
+        else:
+            print(f"State of {lobby_name} never arrived, dropped {len(held)} messages held for it")
@@ -0,0 +1,252 @@
+import time
+
+from distanceCache import UNREACHABLE
+
+MOVES = (((0, -1), "LEFT"), ((0, 1), "RIGHT"), ((-1, 0), "UP"), ((1, 0), "DOWN"))
+
+
+class DeadlineReached(Exception):
+    pass
+
+
+class LookaheadPlanner:
+    def __init__(self, deadline: float = 0.05, max_depth: int = 16, discount: float = 0.9):
+        """
+        Iterative deepening search over our next moves on a compact copy of the known board.
+        Teammates and enemies are simulated walking to their nearest known coin, what a teammate
+        collects counts for us and what an enemy collects against us. PlayerMap.next_move answers
+        when no coin is known and when the deadline comes before the first depth is searched
+        :param deadline: seconds of planning per turn, at most half of it goes to loading coin distances
+        :param max_depth: moves looked ahead at most
+        :param discount: weight of a coin one move later, so nearer coins win ties
+        """
+        self.deadline = deadline
+        self.max_depth = max_depth
+        self.discount = discount
+        self.walls: set[tuple[int, int]] = set()  # walls the neighbor lists were built with
+        self.neighbors: dict[int, list[int]] = {}  # open neighbors of each cell searched so far
+        self.shape = None
+        self.last: dict = {}  # {'depth', 'nodes', 'ms'} of the last turn
+        self.turns = 0
+        self.nodes_total = 0
+        self.time_total = 0.0
+        self.time_max = 0.0
+
+    def next_move(self, player_map):
+        """
+        :return: (direction, next_coords) like PlayerMap.next_move
+        """
+        started = time.perf_counter()
+        self.stop_at = started + self.deadline
+        self.nodes = 0
+        move = None
+        depth = 0
+        if self.load(player_map, started + self.deadline / 2):
+            best_move = None
+            for depth in range(1, self.max_depth + 1):
+                try:
+                    best_move, complete = self.search_root(depth, best_move)
+                except DeadlineReached as reached:
+                    if reached.args:
+                        best_move = reached.args[0]
+                    depth -= 1
+                    break
+                if complete:
+                    # Every line ended before the depth limit, looking further changes nothing
+                    break
+            move = best_move
+        if move is None:
+            move = player_map.next_move()
+        elapsed = time.perf_counter() - started
+        self.last = {"depth": depth, "nodes": self.nodes, "ms": 1000 * elapsed}
+        self.turns += 1
+        self.nodes_total += self.nodes
+        self.time_total += elapsed
+        self.time_max = max(self.time_max, elapsed)
+        return move
+
+    def stats(self) -> dict:
+        """
+        :return: turns planned, nodes and time per turn in milliseconds
+        """
+        return {
+            "turns": self.turns,
+            "nodes_mean": self.nodes_total / self.turns if self.turns else 0,
+            "time_mean_ms": 1000 * self.time_total / self.turns if self.turns else 0,
+            "time_max_ms": 1000 * self.time_max,
+            **self.last,
+        }
+
+    def load(self, player_map, load_until: float) -> bool:
+        """
+        Copies what the search needs into tables indexed x * columns + y. Coins are loaded nearest
+        first, those whose distances are not ready by load_until are left out of this turn's search
+        :return: False when no known coin can be reached
+        """
+        rows, columns = player_map.rows, player_map.columns
+        self.rows, self.columns = rows, columns
+        self.update_walls(player_map.walls)
+        start = player_map.current_position
+        self.start = start[0] * columns + start[1]
+        coins = sorted(
+            (
+                (coord, value)
+                for value, store in enumerate((player_map.coin1, player_map.coin2, player_map.coin3), start=1)
+                for coord in store
+            ),
+            key=lambda coin: abs(coin[0][0] - start[0]) + abs(coin[0][1] - start[1]),
+        )
+        # Distances from each coin, the same as to each coin since every move can be undone.
+        # Fields stay cached in player_map.distances, so what is cut off now is loaded on a later turn
+        self.coin_fields = []
+        for coord, _ in coins:
+            if time.perf_counter() > load_until:
+                break
+            self.coin_fields.append(player_map.distances.field(coord))
+        coins = coins[:len(self.coin_fields)]
+        if all(field[self.start] == UNREACHABLE for field in self.coin_fields):
+            return False
+        self.values = [value for _, value in coins]
+        self.coin_at = {coord[0] * columns + coord[1]: j for j, (coord, _) in enumerate(coins)}
+
+        agents = [(coord, 1) for coord in player_map.teammates.values()]
+        agents += [(coord, -1) for coord in player_map.enemies]
+        self.agents = tuple(coord[0] * columns + coord[1] for coord, _ in agents)
+        self.signs = [sign for _, sign in agents]
+        self.root_moves = []
+        for (dx, dy), direction in MOVES:
+            x, y = start[0] + dx, start[1] + dy
+            if 0 <= x < rows and 0 <= y < columns and player_map.map[x, y] != -1:
+                self.root_moves.append((x * columns + y, direction, [x, y]))
+        return bool(self.root_moves)
+
+    def update_walls(self, walls: set):
+        """
+        Drops the neighbor lists next to walls found since the last turn, the rest are kept
+        """
+        if self.shape != (self.rows, self.columns):
+            self.shape = (self.rows, self.columns)
+            self.walls = set()
+            self.neighbors = {}
+        if len(walls) == len(self.walls):
+            return
+        for x, y in walls - self.walls:
+            for dx, dy in ((0, 0), (0, -1), (0, 1), (-1, 0), (1, 0)):
+                self.neighbors.pop((x + dx) * self.columns + y + dy, None)
+        self.walls = set(walls)
+
+    def neighbors_of(self, position: int) -> list[int]:
+        neighbors = self.neighbors.get(position)
+        if neighbors is None:
+            x, y = divmod(position, self.columns)
+            neighbors = [
+                (x + dx) * self.columns + y + dy
+                for (dx, dy), _ in MOVES
+                if 0 <= x + dx < self.rows and 0 <= y + dy < self.columns and (x + dx, y + dy) not in self.walls
+            ]
+            self.neighbors[position] = neighbors
+        return neighbors
+
+    def search_root(self, depth: int, previous):
+        """
+        :param previous: best move of the last depth, searched first
+        :return: (best move, True if no line reached the depth limit)
+        :raise DeadlineReached: with the best move so far once the first move was searched
+        """
+        self.memo = {}
+        self.cut = False
+        moves = sorted(self.root_moves, key=lambda move: previous is None or move[1] != previous[0])
+        best_value = -float("inf")
+        best_move = None
+        for target, direction, next_coords in moves:
+            try:
+                value = self.play(self.start, target, (1 << len(self.values)) - 1, self.agents, depth)
+            except DeadlineReached:
+                if best_move is None:
+                    raise
+                # The previous best was searched to this depth, what beat it so far is the better move
+                raise DeadlineReached(best_move)
+            if value > best_value:
+                best_value = value
+                best_move = (direction, next_coords)
+        return best_move, not self.cut
+
+    def play(self, position: int, target: int, mask: int, agents: tuple, depth: int) -> float:
+        # We move first, onto target unless an agent stands there, then every agent takes a step
+        if target in agents:
+            target = position
+        gain = 0.0
+        j = self.coin_at.get(target)
+        if j is not None and mask >> j & 1:
+            gain += self.values[j]
+            mask &= ~(1 << j)
+        agents, agent_gain, mask = self.step_agents(agents, target, mask)
+        return gain + agent_gain + self.discount * self.search(target, mask, agents, depth - 1)
+
+    def search(self, position: int, mask: int, agents: tuple, depth: int) -> float:
+        self.nodes += 1
+        if not self.nodes & 15 and time.perf_counter() > self.stop_at:
+            raise DeadlineReached
+        if not mask:
+            return 0.0
+        if depth == 0:
+            self.cut = True
+            return self.estimate(position, mask)
+        key = (position, mask, agents, depth)
+        value = self.memo.get(key)
+        if value is not None:
+            return value
+        neighbors = self.neighbors_of(position)
+        if not neighbors:
+            return self.estimate(position, mask)
+        value = max(self.play(position, target, mask, agents, depth) for target in neighbors)
+        self.memo[key] = value
+        return value
+
+    def estimate(self, position: int, mask: int) -> float:
+        # The best single coin still reachable, discounted by its distance
+        best = 0.0
+        j = 0
+        while mask:
+            if mask & 1:
+                distance = self.coin_fields[j][position]
+                if distance != UNREACHABLE:
+                    best = max(best, self.values[j] * self.discount ** distance)
+            mask >>= 1
+            j += 1
+        return best
+
+    def step_agents(self, agents: tuple, ours: int, mask: int):
+        """
+        Moves each agent one step towards its nearest remaining coin
+        :return: (new positions, value collected by them signed by side, remaining coins)
+        """
+        moved = []
+        gain = 0.0
+        occupied = set(agents)
+        occupied.add(ours)
+        for agent, sign in zip(agents, self.signs):
+            nearest = None
+            nearest_distance = UNREACHABLE
+            bits = mask
+            j = 0
+            while bits:
+                if bits & 1 and self.coin_fields[j][agent] < nearest_distance:
+                    nearest = j
+                    nearest_distance = self.coin_fields[j][agent]
+                bits >>= 1
+                j += 1
+            if nearest is not None:
+                field = self.coin_fields[nearest]
+                for step in self.neighbors_of(agent):
+                    if field[step] < nearest_distance and step not in occupied:
+                        occupied.discard(agent)
+                        occupied.add(step)
+                        agent = step
+                        break
+            moved.append(agent)
+            j = self.coin_at.get(agent)
+            if j is not None and mask >> j & 1:
+                gain += sign * self.values[j]
+                mask &= ~(1 << j)
+        return tuple(moved), gain, mask
@@ -6,6 +6,7 @@ from copy import deepcopy
 from player import Player
 import random
 from gameItems import *
+from zobrist import cellKey
 from typing import Optional
 
 def getDefaultWallChoices():
@@ -34,18 +35,44 @@ class Map:
         self.__map: list[list[object]] = [[None for _ in range(width)] for _ in range(height)]
 
         self.__numCoins = 0
+        self.__coinsByValue = {1: 0, 2: 0, 3: 0}
+        self.__coinValue = 0
 
         self.wallChoices = getDefaultWallChoices() if wallChoices is None else wallChoices
+        self.__playerIndex = {player.name: i for i, player in enumerate(playersList)}
 
         self.__fillMap(playersList)
-
+        self.__hash = self.__fullHash()
 
     @property
     def numCoins(self):
         return self.__numCoins
-    
-    def decreaseCoin(self):
-        self.__numCoins -= 1
+
+    @property
+    def coinsByValue(self) -> dict[int, int]:
+        """
+        Remaining coins per coin value, kept up to date by set
+        """
+        return dict(self.__coinsByValue)
+
+    @property
+    def coinValue(self) -> int:
+        """
+        Total value of the remaining coins
+        """
+        return self.__coinValue
+
+    def __countCoin(self, coin: Coin, count: int):
+        self.__numCoins += count
+        self.__coinsByValue[coin.value] += count
+        self.__coinValue += count * coin.value
+
+    @property
+    def hash(self) -> int:
+        """
+        Zobrist hash of every item on the map, kept up to date by set
+        """
+        return self.__hash
 
     @property
     def map(self):
@@ -77,14 +104,70 @@ class Map:
 
         return output
 
+    def toDict(self) -> dict:
+        """
+        :return: walls and coins of the map, players are stored with their own location
+        """
+        data = {'height': self.__height,
+                'width': self.__width,
+                'walls': [],
+                'coin1': [],
+                'coin2': [],
+                'coin3': []}
+        for x, row in enumerate(self.__map):
+            for y, cell in enumerate(row):
+                if isinstance(cell, Wall):
+                    data['walls'].append((x, y))
+                elif isinstance(cell, Coin):
+                    data[f'coin{cell.value}'].append((x, y))
+        return data
+
+    @classmethod
+    def fromDict(cls, data: dict, playersList: list[Player]):
+        """
+        Rebuilds a map saved with toDict, players must already have their locations set
+        """
+        m = cls.__new__(cls)
+        m.__height = data['height']
+        m.__width = data['width']
+        m.__map = [[None for _ in range(m.__width)] for _ in range(m.__height)]
+        m.wallChoices = [tuple(loc) for loc in data['walls']]
+        for x, y in data['walls']:
+            m.__map[x][y] = Wall()
+        m.__numCoins = 0
+        m.__coinsByValue = {1: 0, 2: 0, 3: 0}
+        m.__coinValue = 0
+        for coinType, key in ((Coin1, 'coin1'), (Coin2, 'coin2'), (Coin3, 'coin3')):
+            for x, y in data[key]:
+                m.__map[x][y] = coinType()
+                m.__countCoin(m.__map[x][y], 1)
+        m.__playerIndex = {player.name: i for i, player in enumerate(playersList)}
+        for player in playersList:
+            m.__map[player.loc[0]][player.loc[1]] = player
+        m.__hash = m.__fullHash()
+        return m
+
     def set(self, loc: tuple[int, int], item: object):
         assert isinstance(loc, tuple) and len(loc) == 2 and isinstance(loc[0], int) and isinstance(loc[1], int)
+        old = self.__map[loc[0]][loc[1]]
+        self.__hash ^= cellKey(loc, old, self.__playerIndex) ^ cellKey(loc, item, self.__playerIndex)
+        if isinstance(old, Coin):
+            self.__countCoin(old, -1)
+        if isinstance(item, Coin):
+            self.__countCoin(item, 1)
         self.__map[loc[0]][loc[1]] = item
 
     def get(self, loc: tuple[int, int]):
         assert isinstance(loc, tuple) and len(loc) == 2 and isinstance(loc[0], int) and isinstance(loc[1], int)
         return self.__map[loc[0]][loc[1]]
 
+    def __fullHash(self) -> int:
+        value = 0
+        for x, row in enumerate(self.__map):
+            for y, cell in enumerate(row):
+                value ^= cellKey((x, y), cell, self.__playerIndex)
+        return value
+
     def __fillMap(self, players: list[Player]):
         assert isinstance(players, list)
 
@@ -108,10 +191,11 @@ class Map:
         numPlayers = len(players)
         empty = empty - numWalls - numPlayers
 
-        self.__numCoins = random.randint(int(Map.COIN_MIN_RATIO * empty), int(Map.COIN_MAX_RATIO * empty))
-        for _ in range(self.__numCoins):
+        numCoins = random.randint(int(Map.COIN_MIN_RATIO * empty), int(Map.COIN_MAX_RATIO * empty))
+        for _ in range(numCoins):
             coin = random.choices((Coin1, Coin2, Coin3), (6,3,1))[0]()
             self.__placeRandom(coin)
+            self.__countCoin(coin, 1)
 
     def __placeRandom(self, obj, choice: Optional[list] = None):
         while True:
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+
+import paho.mqtt.client as paho
+
+
+class OutboundQueue:
+    def __init__(self, client, max_depth: int = 32, latest_only: tuple[str] = ("game_state",)):
+        """
+        Publishes through the client with at most one QoS 1/2 message in flight per topic,
+        holding everything else in a bounded queue per destination topic. QoS 0 messages are
+        never held for an ack, paho drops unwritten ones on reconnect without calling on_publish
+        :param client: the paho client messages are published with, on_publish must be called on
+        the thread that publishes so an ack never arrives before publish() returned its mid
+        :param max_depth: most messages kept waiting for one topic, the oldest is dropped past that
+        :param latest_only: topic suffixes where only the newest unsent message matters
+        """
+        self.client = client
+        self.max_depth = max_depth
+        self.latest_only = latest_only
+        self.queues: dict[str, deque] = {}
+        self.in_flight: dict[int, str] = {}  # {mid : topic}
+        self.busy: set[str] = set()
+        self.lock = threading.RLock()
+        self.counters = {"sent": 0, "superseded": 0, "dropped": 0, "max_depth_seen": 0}
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False):
+        """
+        Sends the message now if nothing is in flight for the topic, otherwise queues it
+        """
+        with self.lock:
+            if topic not in self.busy:
+                self.__send(topic, (payload, qos, retain))
+                return
+
+            queue = self.queues.setdefault(topic, deque())
+            if queue and topic.endswith(self.latest_only):
+                # Only the newest state matters, replace whatever has not been sent yet
+                queue.clear()
+                self.counters["superseded"] += 1
+            elif len(queue) >= self.max_depth:
+                queue.popleft()
+                self.counters["dropped"] += 1
+            queue.append((payload, qos, retain))
+            self.counters["max_depth_seen"] = max(self.counters["max_depth_seen"], len(queue))
+
+    def on_publish(self, mid: int):
+        """
+        Releases the topic of an acknowledged message and sends the next one waiting for it
+        :param mid: message id given to the client's on_publish callback
+        """
+        with self.lock:
+            topic = self.in_flight.pop(mid, None)
+            if topic is None:
+                # QoS 0 or published around the queue
+                return
+            self.__release(topic)
+
+    def depth(self) -> int:
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                **self.counters,
+                "depth": self.depth(),
+                "topics_waiting": len(self.queues),
+                "in_flight": len(self.in_flight),
+            }
+
+    def __send(self, topic: str, message: tuple):
+        payload, qos, retain = message
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        self.counters["sent"] += 1
+        if qos == 0 or info.rc not in (paho.MQTT_ERR_SUCCESS, paho.MQTT_ERR_NO_CONN):
+            # Nothing reliable will acknowledge it, either qos 0 or not queued by paho at all.
+            # QoS 1/2 published while disconnected is kept by paho and acknowledged after the reconnect
+            self.__release(topic)
+            return
+        self.in_flight[info.mid] = topic
+        self.busy.add(topic)
+
+    def __release(self, topic: str):
+        self.busy.discard(topic)
+        queue = self.queues.get(topic)
+        if not queue:
+            self.queues.pop(topic, None)
+            return
+        message = queue.popleft()
+        if not queue:
+            del self.queues[topic]
+        self.__send(topic, message)
@@ -0,0 +1,110 @@
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int, now: float = None):
+        """
+        Classic token bucket, refilled lazily whenever a token is requested
+        :param rate: tokens added per unit of the clock given to take, seconds by default
+        :param burst: maximum number of tokens the bucket can hold
+        :param now: current time on that clock, monotonic time if not given
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic() if now is None else now
+
+    def take(self, now: float = None) -> bool:
+        """
+        Removes one token if available
+        :param now: current monotonic time, looked up if not given
+        :return: True if the caller may proceed
+        """
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class MoveLimiter:
+    def __init__(self, rate: float = 2, burst: int = 4):
+        """
+        Admission control for incoming move messages, checked before any payload decoding.
+        Buckets refill with every resolved turn of their lobby rather than with wall time,
+        so the limit means the same at any turn or tick rate
+        :param rate: sustained moves per turn allowed for each player
+        :param burst: moves a player may send back to back before being limited
+        """
+        self.rate = rate
+        self.burst = burst
+        self.turns: dict[str, int] = {}  # {'lobby_name' : turns resolved}, the buckets' clock
+        self.buckets: dict[tuple[str, str], TokenBucket] = {}
+        # {'lobby_name' : {'player_name' : last accepted payload this turn}}, dropped whole every turn
+        self.pending: dict[str, dict[str, bytes]] = {}
+        self.dropped: dict[tuple[str, str], dict[str, int]] = {}
+        self.totals = {"accepted": 0, "rate_limited": 0, "duplicate": 0}
+
+    def admit(self, lobby_name: str, player_name: str, msg_payload: bytes) -> bool:
+        """
+        Decides whether a move should reach the game
+        :param lobby_name: lobby the move was published to, must have a running game
+        :param player_name: player that published the move, must be in that game
+        :param msg_payload: raw move payload
+        :return: False if the move was rate limited or repeats the player's pending move
+        """
+        key = (lobby_name, player_name)
+        turn = self.turns.get(lobby_name, 0)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now=turn)
+
+        if not bucket.take(turn):
+            self.__drop(key, "rate_limited")
+            return False
+
+        pending = self.pending.setdefault(lobby_name, {})
+        if pending.get(player_name) == msg_payload:
+            self.__drop(key, "duplicate")
+            return False
+
+        pending[player_name] = msg_payload
+        self.totals["accepted"] += 1
+        return True
+
+    def end_turn(self, lobby_name: str):
+        """
+        Forgets pending moves of a lobby once its turn has been resolved and refills its buckets
+        """
+        self.turns[lobby_name] = self.turns.get(lobby_name, 0) + 1
+        self.pending.pop(lobby_name, None)
+
+    def remove_lobby(self, lobby_name: str):
+        """
+        Drops all buckets and counters of a finished lobby
+        """
+        self.end_turn(lobby_name)
+        self.turns.pop(lobby_name, None)
+        for key in [key for key in self.buckets if key[0] == lobby_name]:
+            del self.buckets[key]
+            self.dropped.pop(key, None)
+
+    def stats(self) -> dict:
+        """
+        :return: totals plus the drop counters of every player that had a move dropped
+        """
+        return {
+            "totals": dict(self.totals),
+            "players": {
+                f"{lobby}/{player}": dict(counts)
+                for (lobby, player), counts in self.dropped.items()
+            },
+        }
+
+    def __drop(self, key: tuple[str, str], reason: str):
+        self.totals[reason] += 1
+        counts = self.dropped.setdefault(key, {"rate_limited": 0, "duplicate": 0})
+        counts[reason] += 1
@@ -0,0 +1,84 @@
+import ssl
+
+import paho.mqtt.client as paho
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+
+class ResumingTLSContext(ssl.SSLContext):
+    """
+    TLS context that offers the previous connection's session, so a reconnect
+    does an abbreviated handshake instead of a full one
+    """
+
+    session = None
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.session is not None:
+            kwargs.setdefault("session", self.session)
+        return super().wrap_socket(sock, *args, **kwargs)
+
+
+class SessionClient(paho.Client):
+    def __init__(
+        self,
+        client_id: str,
+        userdata=None,
+        session_expiry: int = 3600,
+        min_delay: float = 1,
+        max_delay: float = 60,
+    ):
+        """
+        MQTT v5 client that reconnects with exponential backoff and keeps its broker session,
+        so subscriptions and QoS 1/2 messages sent while it was offline survive a network blip.
+        The first connect starts a clean session, only the reconnects of this run resume it,
+        so a new run never inherits what an earlier one left queued
+        :param client_id: unique among the clients connected at the same time
+        :param session_expiry: seconds the broker keeps the session after a disconnect
+        :param min_delay: first reconnect delay in seconds, doubled after every failed attempt
+        :param max_delay: longest reconnect delay in seconds
+        """
+        super().__init__(client_id=client_id, userdata=userdata, protocol=paho.MQTTv5)
+        self.session_expiry = session_expiry
+        self.subscriptions: dict[str, int] = {}  # {'topic' : qos}, replayed if the session was lost
+        self.on_session = None  # on_session(client, session_present) after every (re)connect
+        self.connections = 0
+        self.tls_context = ResumingTLSContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.tls_context.load_default_certs()
+        self.tls_set_context(self.tls_context)
+        self.reconnect_delay_set(min_delay, max_delay)
+        self.on_connect = self.__on_connect
+
+    def connect(self, host: str, port: int = 8883, keepalive: int = 60):
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = self.session_expiry
+        return super().connect(
+            host, port, keepalive, clean_start=paho.MQTT_CLEAN_START_FIRST_ONLY, properties=properties
+        )
+
+    def subscribe(self, topic: str, qos: int = 1, options=None, properties=None):
+        """
+        Subscribes at QoS 1 by default so the broker queues messages while the client is away
+        """
+        self.subscriptions[topic] = qos
+        return super().subscribe(topic, qos, options, properties)
+
+    def unsubscribe(self, topic: str, properties=None):
+        self.subscriptions.pop(topic, None)
+        return super().unsubscribe(topic, properties)
+
+    def __on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            print("CONNACK received with code %s." % rc)
+            return
+        sock = self.socket()
+        if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+            self.tls_context.session = sock.session
+
+        self.connections += 1
+        session_present = bool(flags.get("session present"))
+        if not session_present and self.connections > 1 and self.subscriptions:
+            # The broker forgot us while we were away (expired session), subscribe again
+            super().subscribe(list(self.subscriptions.items()))
+        if self.on_session is not None:
+            self.on_session(self, session_present)
@@ -0,0 +1,90 @@
+import json
+import zlib
+
+
+def shard_of(lobby_name: str, num_shards: int) -> int:
+    """
+    Stable across processes and restarts, unlike the builtin hash()
+    """
+    return zlib.crc32(lobby_name.encode()) % num_shards
+
+
+def lobby_of(topic_list: list[str], msg_payload: bytes):
+    """
+    :return: the lobby a message belongs to, None for server wide messages
+    """
+    if topic_list[0] == "games" and len(topic_list) > 2:
+        return topic_list[1]
+    if topic_list[-1] == "new_game":
+        try:
+            return json.loads(msg_payload)["lobby_name"]
+        except (ValueError, KeyError, TypeError):
+            return None
+    return None
+
+
+class ShardRouter:
+    SHARE_GROUP = "gameservers"
+
+    def __init__(self, shard: int = 0, num_shards: int = 1):
+        """
+        Decides which worker process owns a lobby
+        :param shard: index of this worker
+        :param num_shards: number of workers, 1 runs unsharded
+        """
+        self.shard = shard
+        self.num_shards = num_shards
+        self.forwarded = 0
+
+    def subscriptions(self, topics: list[str]) -> list[str]:
+        """
+        Shares the player facing topics between workers, plus this worker's private forwarding topic
+        """
+        if self.num_shards == 1:
+            return topics
+        return [f"$share/{self.SHARE_GROUP}/{topic}" for topic in topics] + [
+            f"shards/{self.shard}/#"
+        ]
+
+    def local_topic(self, topic_list: list[str]) -> list[str]:
+        """
+        Strips the forwarding prefix so forwarded messages dispatch like direct ones
+        """
+        if topic_list[0] == "shards" and len(topic_list) > 2:
+            return topic_list[2:]
+        return topic_list
+
+    def owner(self, topic_list: list[str], msg_payload: bytes):
+        """
+        :return: index of the owning worker, None if any worker may handle the message
+        """
+        if self.num_shards == 1:
+            return None
+        lobby_name = lobby_of(topic_list, msg_payload)
+        if lobby_name is None:
+            return None
+        return shard_of(lobby_name, self.num_shards)
+
+    def intercept(self, client, topic_list: list[str], msg_payload: bytes) -> bool:
+        """
+        Forwards messages whose lobby belongs to another worker
+        :return: True if the message must not be dispatched here
+        """
+        owner = self.owner(topic_list, msg_payload)
+        if owner is None or owner == self.shard:
+            return False
+        self.forward(client, owner, topic_list, msg_payload)
+        return True
+
+    def forward(self, client, owner: int, topic_list: list[str], msg_payload: bytes):
+        """
+        Hands a message received through the shared subscription to the worker owning its lobby.
+        Published on the client itself, which keeps every QoS 1 message until it is acked and has many
+        in flight at once. The outbound queue would send a shard's joins one ack at a time on one topic
+        and drop them past its depth
+        """
+        self.forwarded += 1
+        client.publish(f"shards/{owner}/" + "/".join(topic_list), msg_payload, qos=1)
+
+    def stats(self) -> dict:
+        return {"shard": self.shard, "shards": self.num_shards, "forwarded": self.forwarded}
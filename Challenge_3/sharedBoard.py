@@ -0,0 +1,206 @@
+import sys
+import json
+import time
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+from game import Game
+from gameItems import Wall, Coin
+from gameEvents import PlayerMoved, CoinCollected
+from player import Player
+
+# version, height, width, number of players, number of teams, length of the names block
+HEADER = struct.Struct("<QHHHHI")
+LOC = struct.Struct("<hh")
+SCORE = struct.Struct("<i")
+
+# Cell codes, a player is PLAYER + its index in the names block
+EMPTY = 0
+WALL = 1
+COIN = 1  # COIN + value, so 2, 3 and 4
+PLAYER = 5
+
+
+def shared_name(lobby_name: str, prefix: str = "board_") -> str:
+    return f"{prefix}{lobby_name}"
+
+
+class SharedBoard:
+    def __init__(self, lobby_name: str, game: Game, prefix: str = "board_"):
+        """
+        Mirrors a lobby's board, player locations and scores into shared memory for sidecar
+        processes, see BoardReader. Writes are guarded by a seqlock: the version is odd while
+        the game changes the board and even again once the board is consistent. A mirror fed by the
+        game's events rather than Map's own storage, since Map, its hashing, snapshots and game
+        states all work on the Player, Wall and Coin objects in its cells. It costs about 2 us per move
+        :param lobby_name: the shared memory block is named prefix + lobby_name
+        :param game: game to mirror, its events keep the block up to date
+        """
+        self.game = game
+        self.players = list(game.all_players.keys())
+        self.teams = list(game.teams.keys())
+        assert PLAYER + len(self.players) <= 256
+        self.player_index = {name: index for index, name in enumerate(self.players)}
+        self.team_index = {name: index for index, name in enumerate(self.teams)}
+        names = json.dumps({"players": self.players, "teams": self.teams}).encode()
+
+        height, width = game.map.height, game.map.width
+        self.cells_at = HEADER.size + len(names)
+        self.locs_at = self.cells_at + height * width
+        self.scores_at = self.locs_at + LOC.size * len(self.players)
+        size = self.scores_at + SCORE.size * len(self.teams)
+
+        name = shared_name(lobby_name, prefix)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a server that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buf = self.shm.buf
+        self.version = 0
+        self.depth = 0
+        self.width = width
+
+        HEADER.pack_into(self.buf, 0, 0, height, width, len(self.players), len(self.teams), len(names))
+        self.buf[HEADER.size:self.cells_at] = names
+        self.begin()
+        for x in range(height):
+            for y in range(width):
+                self.buf[self.cells_at + x * width + y] = self.__code(game.map.get((x, y)))
+        for name, player in game.all_players.items():
+            LOC.pack_into(self.buf, self.locs_at + LOC.size * self.player_index[name], *player.loc)
+        for name, team in game.teams.items():
+            SCORE.pack_into(self.buf, self.scores_at + SCORE.size * self.team_index[name], team.score)
+        self.end()
+        game.addObserver(self.on_event)
+
+    def begin(self):
+        """
+        Starts a write, nested calls share one version bump so a whole turn can be published at once
+        """
+        self.depth += 1
+        if self.depth == 1:
+            self.version += 1
+            struct.pack_into("<Q", self.buf, 0, self.version)
+
+    def end(self):
+        self.depth -= 1
+        if self.depth == 0:
+            self.version += 1
+            struct.pack_into("<Q", self.buf, 0, self.version)
+
+    def on_event(self, event):
+        if isinstance(event, PlayerMoved):
+            self.begin()
+            x, y = event.origin
+            self.buf[self.cells_at + x * self.width + y] = EMPTY
+            x, y = event.target
+            index = self.player_index[event.player.name]
+            self.buf[self.cells_at + x * self.width + y] = PLAYER + index
+            LOC.pack_into(self.buf, self.locs_at + LOC.size * index, x, y)
+            self.end()
+        elif isinstance(event, CoinCollected):
+            self.begin()
+            team = event.player.team
+            SCORE.pack_into(self.buf, self.scores_at + SCORE.size * self.team_index[team.name], team.score)
+            self.end()
+
+    def close(self):
+        self.game.removeObserver(self.on_event)
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def __code(self, cell: object) -> int:
+        if cell is None:
+            return EMPTY
+        if isinstance(cell, Player):
+            return PLAYER + self.player_index[cell.name]
+        if isinstance(cell, Wall):
+            return WALL
+        if isinstance(cell, Coin):
+            return COIN + cell.value
+        return EMPTY
+
+
+class BoardReader:
+    def __init__(self, lobby_name: str, prefix: str = "board_"):
+        """
+        Attaches to a SharedBoard from another process, reads never copy unless asked to
+        """
+        name = shared_name(lobby_name, prefix)
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Only the server owns the block, do not let this process' tracker unlink it at exit
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.buf = self.shm.buf
+        _, self.height, self.width, num_players, num_teams, names_length = HEADER.unpack_from(self.buf, 0)
+        names = json.loads(bytes(self.buf[HEADER.size:HEADER.size + names_length]))
+        self.players: list[str] = names["players"]
+        self.teams: list[str] = names["teams"]
+        self.cells_at = HEADER.size + names_length
+        self.locs_at = self.cells_at + self.height * self.width
+        self.scores_at = self.locs_at + LOC.size * num_players
+        self.retries = 0
+
+    def version(self) -> int:
+        return struct.unpack_from("<Q", self.buf, 0)[0]
+
+    def read(self, visit):
+        """
+        Calls visit(cells, locs, scores) with memoryviews into the shared block until it ran
+        without the server writing in between, visit must not keep the views
+        :return: whatever visit returned on the consistent pass
+        """
+        cells = self.buf[self.cells_at:self.locs_at]
+        locs = self.buf[self.locs_at:self.scores_at]
+        scores = self.buf[self.scores_at:self.scores_at + SCORE.size * len(self.teams)]
+        try:
+            while True:
+                before = self.version()
+                if before & 1:
+                    time.sleep(0)
+                    continue
+                result = visit(cells, locs, scores)
+                if self.version() == before:
+                    return result
+                self.retries += 1
+        finally:
+            cells.release()
+            locs.release()
+            scores.release()
+
+    def snapshot(self) -> dict:
+        """
+        :return: a consistent copy of the board, {'rows': [bytes of cell codes, ...], 'players': {name : (x,y)}, 'scores': {team : score}}
+        """
+        def copy(cells, locs, scores):
+            return bytes(cells), bytes(locs), bytes(scores)
+
+        cells, locs, scores = self.read(copy)
+        return {
+            "rows": [cells[x * self.width:(x + 1) * self.width] for x in range(self.height)],
+            "players": {name: LOC.unpack_from(locs, LOC.size * index) for index, name in enumerate(self.players)},
+            "scores": {name: SCORE.unpack_from(scores, SCORE.size * index)[0] for index, name in enumerate(self.teams)},
+        }
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+if __name__ == "__main__":
+    # Sidecar example: python sharedBoard.py <lobby_name>
+    reader = BoardReader(sys.argv[1])
+    chars = {EMPTY: ".", WALL: "#", COIN + 1: "1", COIN + 2: "2", COIN + 3: "3"}
+    try:
+        while True:
+            board = reader.snapshot()
+            for row in board["rows"]:
+                print("".join(chars.get(code, "P") for code in row))
+            print(board["scores"])
+            time.sleep(1)
+    except KeyboardInterrupt:
+        reader.close()
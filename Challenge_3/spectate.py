@@ -0,0 +1,113 @@
+import json
+import time
+
+from game import Game
+from gameEvents import PlayerMoved
+from zobrist import formatHash
+from gameItems import Wall, Coin
+from player import Player
+
+
+def cell_char(cell: object) -> str:
+    """
+    One character per cell: . empty, # wall, 1-3 coin value, P player (see the players field)
+    """
+    if cell is None:
+        return "."
+    if isinstance(cell, Player):
+        return "P"
+    if isinstance(cell, Wall):
+        return "#"
+    if isinstance(cell, Coin):
+        return str(cell.value)
+    return "?"
+
+
+class SpectatorStream:
+    def __init__(self, lobby_name: str, game: Game, publish, max_rate: float = 5, keyframe_interval: float = 1):
+        """
+        Publishes a lobby's board to games/<lobby>/spectate (retained full keyframe)
+        and games/<lobby>/spectate/delta (changed cells only)
+        :param publish: publish(topic, payload, qos, retain), usually the server's outbound queue
+        :param max_rate: most deltas per second, faster turns are merged into one delta
+        :param keyframe_interval: seconds between two keyframes while the board changes, which bounds how
+        stale the retained keyframe a late joiner receives can be. A spectator that sees a gap in seq waits
+        for the next one
+        """
+        self.topic = f"games/{lobby_name}/spectate"
+        self.game = game
+        self.publish = publish
+        self.interval = 1 / max_rate
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.last = 0.0
+        self.last_keyframe = 0.0
+        self.pending: set[tuple[int, int]] = set()
+        game.addObserver(self.on_event)
+        self.keyframe()
+
+    def keyframe(self):
+        """
+        Publishes the whole board retained, spectators connecting later receive it right away
+        """
+        self.seq += 1
+        self.pending.clear()
+        board = self.game.map
+        rows = [
+            "".join(cell_char(board.get((x, y))) for y in range(board.width))
+            for x in range(board.height)
+        ]
+        payload = {
+            "seq": self.seq,
+            "rows": rows,
+            "players": self.__players(),
+            "scores": self.game.getScores(),
+            "stateHash": formatHash(self.game.stateHash),
+        }
+        self.publish(self.topic, json.dumps(payload), 1, True)
+        self.last = self.last_keyframe = time.monotonic()
+
+    def on_event(self, event):
+        # Coins are only ever collected by moving onto them, a move covers both cells it changed
+        if isinstance(event, PlayerMoved):
+            self.pending.add(event.origin)
+            self.pending.add(event.target)
+
+    def turn_finished(self):
+        """
+        Publishes the cells changed since the last delta if the rate limit allows
+        """
+        if time.monotonic() - self.last < self.interval:
+            return
+        self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if time.monotonic() - self.last_keyframe >= self.keyframe_interval:
+            self.keyframe()
+            return
+        self.seq += 1
+        board = self.game.map
+        payload = {
+            "seq": self.seq,
+            "cells": [(x, y, cell_char(board.get((x, y)))) for x, y in self.pending],
+            "players": self.__players(),
+            "scores": self.game.getScores(),
+            "stateHash": formatHash(self.game.stateHash),
+        }
+        self.pending.clear()
+        # Encoded once no matter how many spectators the broker fans it out to
+        self.publish(f"{self.topic}/delta", json.dumps(payload), 0, False)
+        self.last = time.monotonic()
+
+    def close(self):
+        """
+        Sends the final board and clears the retained keyframe
+        """
+        self.game.removeObserver(self.on_event)
+        self.flush()
+        self.publish(self.topic, "", 1, True)
+
+    def __players(self) -> dict:
+        return {name: player.loc for name, player in self.game.all_players.items()}
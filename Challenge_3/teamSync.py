@@ -0,0 +1,159 @@
+import zlib
+import struct
+
+# format, flags, seq, position x, position y, rows, columns, version vector length
+HEADER = struct.Struct("<BBIhhHHB")
+VECTOR_SEQ = struct.Struct("<I")
+COIN = struct.Struct("<Ib")  # cell index, coin value, negative once collected
+FORMAT = 1
+# The message carries everything the sender knows, not just this turn's news, and a bitset of the cells
+# the sender saw itself. Its coins replace the receiver's on those cells, which undoes a lost collected message
+FULL = 1
+DEFLATED = 2  # the body is raw deflate, only used when that is shorter
+
+
+def deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(wbits=-15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def to_bitset(coords, rows: int, columns: int) -> bytearray:
+    bits = bytearray((rows * columns + 7) // 8)
+    for x, y in coords:
+        if 0 <= x < rows and 0 <= y < columns:
+            index = x * columns + y
+            bits[index >> 3] |= 1 << (index & 7)
+    return bits
+
+
+def from_bitset(bits: bytes, columns: int) -> list[tuple[int, int]]:
+    coords = []
+    for byte_index, byte in enumerate(bits):
+        while byte:
+            low = byte & -byte
+            index = (byte_index << 3) + low.bit_length() - 1
+            coords.append(divmod(index, columns))
+            byte ^= low
+    return coords
+
+
+class TeamSync:
+    def __init__(self, rows: int, columns: int, resync_lag: int = 3):
+        """
+        One binary message per player per turn with everything it learned that turn,
+        replacing the separate position, collected, seencoin, seenwall and seencoords topics
+        :param resync_lag: turns a teammate may trail our seq before we send it everything again
+        """
+        self.rows = rows
+        self.columns = columns
+        self.resync_lag = resync_lag
+        self.seq = 0
+        self.received: dict[str, int] = {}  # version vector {'player_name' : last seq applied in order}
+        self.acked: dict[str, int] = {}  # {'player_name' : our seq it last reported}
+        self.full_at = 0
+        self.seen: set = set()
+        self.walls: set = set()
+        self.coins: dict[tuple[int, int], int] = {}
+
+    def record_seen(self, coords):
+        self.seen.update(coords)
+
+    def record_walls(self, walls):
+        self.walls.update(walls)
+
+    def record_coins(self, coins: list[list[tuple[int, int]]], collected: bool = False):
+        """
+        :param coins: [[coin1, ...], [coin2, ...], [coin3, ...]]
+        """
+        for value, coords in enumerate(coins, start=1):
+            for coord in coords:
+                self.coins[coord] = -value if collected else value
+
+    def needs_full(self) -> bool:
+        # A teammate that stopped acknowledging our messages lost one of them
+        behind = any(self.seq - acked > self.resync_lag for acked in self.acked.values())
+        return behind and self.seq - self.full_at > self.resync_lag
+
+    def encode(self, position, player_map=None) -> bytes:
+        """
+        Packs the news recorded since the last message, or the whole of player_map when given
+        """
+        self.seq += 1
+        flags = 0
+        seen, walls, coins = self.seen, self.walls, self.coins
+        if player_map is not None:
+            flags |= FULL
+            self.full_at = self.seq
+            seen = player_map.seen_coords
+            walls = player_map.walls
+            observed = player_map.observed
+            coins = {coord: value for value, store in enumerate(
+                (player_map.coin1, player_map.coin2, player_map.coin3), start=1) for coord in store}
+
+        body = bytearray(to_bitset(seen, self.rows, self.columns))
+        body += to_bitset(walls, self.rows, self.columns)
+        if flags & FULL:
+            body += to_bitset(observed, self.rows, self.columns)
+        for (x, y), value in coins.items():
+            body += COIN.pack(x * self.columns + y, value)
+        self.seen, self.walls, self.coins = set(), set(), {}
+
+        vector = b"".join(
+            struct.pack("<B", len(name.encode())) + name.encode() + VECTOR_SEQ.pack(seq)
+            for name, seq in self.received.items()
+        )
+        body = bytes(body)
+        deflated = deflate(body)
+        if len(deflated) < len(body):
+            flags |= DEFLATED
+            body = deflated
+        header = HEADER.pack(
+            FORMAT, flags, self.seq, position[0], position[1], self.rows, self.columns, len(self.received)
+        )
+        return header + vector + body
+
+    def decode(self, payload: bytes) -> dict:
+        _, flags, seq, x, y, rows, columns, vector_length = HEADER.unpack_from(payload, 0)
+        offset = HEADER.size
+        vector = {}
+        for _ in range(vector_length):
+            length = payload[offset]
+            name = payload[offset + 1:offset + 1 + length].decode()
+            offset += 1 + length
+            vector[name] = VECTOR_SEQ.unpack_from(payload, offset)[0]
+            offset += VECTOR_SEQ.size
+        body = payload[offset:]
+        if flags & DEFLATED:
+            body = zlib.decompress(body, wbits=-15)
+        bitset_length = (rows * columns + 7) // 8
+        bitsets = 3 if flags & FULL else 2
+        coins = [[], [], []]
+        collected = [[], [], []]
+        for coin_offset in range(bitsets * bitset_length, len(body), COIN.size):
+            index, value = COIN.unpack_from(body, coin_offset)
+            (coins if value > 0 else collected)[abs(value) - 1].append(divmod(index, columns))
+        return {
+            "full": bool(flags & FULL),
+            "seq": seq,
+            "position": (x, y),
+            "vector": vector,
+            "seen": from_bitset(body[:bitset_length], columns),
+            "walls": from_bitset(body[bitset_length:2 * bitset_length], columns),
+            "observed": from_bitset(body[2 * bitset_length:bitsets * bitset_length], columns),
+            "coins": coins,
+            "collected": collected,
+        }
+
+    def receive(self, sender: str, me: str, payload: bytes):
+        """
+        :return: the decoded message, None if it is a duplicate or older than what was applied
+        """
+        message = self.decode(payload)
+        last = self.received.get(sender, 0)
+        if message["seq"] <= last:
+            return None
+        if message["full"] or message["seq"] == last + 1:
+            self.received[sender] = message["seq"]
+        # else a message got lost, our vector stays behind until the sender resends everything
+        self.acked[sender] = message["vector"].get(me, 0)
+        return message
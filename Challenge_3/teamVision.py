@@ -0,0 +1,104 @@
+import json
+
+import numpy as np
+
+from game import Game
+from gameItems import Wall, Coin
+from gameEvents import PlayerMoved
+from player import Player
+# Same cell codes as the shared memory board, a player is always PLAYER in TeamVision.cells
+from sharedBoard import EMPTY, WALL, COIN, PLAYER
+
+
+class TeamVision:
+    def __init__(self, lobby_name: str, game: Game, publish, radius: int = 2):
+        """
+        Publishes the union of every team member's view to games/<lobby>/<team>/team_state once per turn,
+        so teammates do not have to piece it together from each other's messages
+        :param publish: publish(topic, payload, qos, retain), usually the server's outbound queue
+        :param radius: vision radius, the same as Game.getGameData's
+        """
+        self.topic = f"games/{lobby_name}"
+        self.game = game
+        self.publish = publish
+        self.radius = radius
+        height, width = game.map.height, game.map.width
+        self.team_names = list(game.teams.keys())
+        self.members = {
+            team_name: [player for player in game.all_players.values() if player.team is team]
+            for team_name, team in game.teams.items()
+        }
+        self.cells = np.zeros((height, width), dtype=np.int8)
+        self.owners = np.full((height, width), -1, dtype=np.int16)  # team index of the player on a cell
+        for x in range(height):
+            for y in range(width):
+                self.__set((x, y), game.map.get((x, y)))
+        self.xs = np.arange(height)[None, :, None]
+        self.ys = np.arange(width)[None, None, :]
+        game.addObserver(self.on_event)
+
+    def on_event(self, event):
+        # A coin disappears under the player that moves onto it
+        if isinstance(event, PlayerMoved):
+            self.__set(event.origin, None)
+            self.__set(event.target, event.player)
+
+    def vision(self, team_name: str) -> np.ndarray:
+        """
+        :return: boolean mask of the cells any member of the team sees
+        """
+        locs = np.array([player.loc for player in self.members[team_name]]).reshape(-1, 2)
+        return (
+            (np.abs(self.xs - locs[:, 0, None, None]) <= self.radius)
+            & (np.abs(self.ys - locs[:, 1, None, None]) <= self.radius)
+        ).any(axis=0)
+
+    def team_state(self, team_name: str) -> dict:
+        """
+        :return: {
+            players: {player_name: (x,y), ...},
+            enemyPositions: [(x,y),...],
+            coin1: [(x,y),...],
+            coin2: [(x,y),...],
+            coin3: [(x,y),...],
+            walls: [(x,y),...]
+        } for everything inside vision(team_name)
+        """
+        mask = self.vision(team_name)
+        enemies = mask & (self.cells == PLAYER) & (self.owners != self.team_names.index(team_name))
+        return {
+            "players": {player.name: player.loc for player in self.members[team_name]},
+            "enemyPositions": np.argwhere(enemies).tolist(),
+            "coin1": np.argwhere(mask & (self.cells == COIN + 1)).tolist(),
+            "coin2": np.argwhere(mask & (self.cells == COIN + 2)).tolist(),
+            "coin3": np.argwhere(mask & (self.cells == COIN + 3)).tolist(),
+            "walls": np.argwhere(mask & (self.cells == WALL)).tolist(),
+        }
+
+    def turn_finished(self):
+        for team_name in self.team_names:
+            self.publish(
+                f"{self.topic}/{team_name}/team_state",
+                json.dumps(self.team_state(team_name)),
+                1,
+                False,
+            )
+
+    def close(self):
+        self.game.removeObserver(self.on_event)
+
+    def __set(self, loc: tuple[int, int], cell: object):
+        owner = -1
+        if cell is None:
+            code = EMPTY
+        elif isinstance(cell, Player):
+            code = PLAYER
+            owner = self.team_names.index(cell.team.name)
+        elif isinstance(cell, Wall):
+            code = WALL
+        elif isinstance(cell, Coin):
+            code = COIN + cell.value
+        else:
+            code = EMPTY
+        self.cells[loc] = code
+        self.owners[loc] = owner
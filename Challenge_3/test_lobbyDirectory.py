@@ -0,0 +1,109 @@
+import time
+
+from lobbyDirectory import HashRing, LobbyDirectory
+
+TIMEOUT = 0.05
+
+
+class Node:
+    # Stands in for a game server's client, everything it publishes goes to the shared network list
+    def __init__(self, node_id: str, network: list):
+        self.network = network
+        self.team_dict = {}
+        self.tasks = []
+        self.dispatched = []
+        self.directory = LobbyDirectory(node_id, self.attach, self.detach, self.replay, handoff_timeout=TIMEOUT)
+
+    def post(self, function, *args):
+        self.tasks.append((function, args))
+
+    def run_tasks(self):
+        while self.tasks:
+            function, args = self.tasks.pop(0)
+            function(*args)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.network.append((topic, payload))
+
+    def attach(self, client, lobby_name, snapshot):
+        self.team_dict[lobby_name] = snapshot
+
+    def detach(self, client, lobby_name):
+        return self.team_dict.pop(lobby_name)
+
+    def replay(self, client, topic_list, msg_payload):
+        self.dispatched.append(("/".join(topic_list), msg_payload))
+
+    def receive(self, topic: str, msg_payload: bytes):
+        topic_list = self.directory.local_topic(topic.split("/"))
+        if not self.directory.intercept(self, topic_list, msg_payload):
+            self.replay(self, topic_list, msg_payload)
+
+
+def deliver(nodes: dict, network: list):
+    while network:
+        topic, payload = network.pop(0)
+        topic_list = topic.split("/")
+        if topic_list[:2] in (["servers", "nodes"], ["servers", "pins"]):
+            for node_id, node in nodes.items():
+                node.receive(topic, payload.encode() if isinstance(payload, str) else payload)
+        else:
+            node = nodes[topic_list[1]]
+            node.receive(topic, payload.encode() if isinstance(payload, str) else payload)
+
+
+def lobby_owned_by(node_id: str) -> str:
+    ring = HashRing(["a", "b"])
+    return next(f"lobby{i}" for i in range(1000) if ring.owner(f"lobby{i}") == node_id)
+
+
+def test_timed_out_handoff_routes_every_node_to_the_old_owner():
+    network = []
+    nodes = {"a": Node("a", network), "b": Node("b", network)}
+    a, b = nodes["a"], nodes["b"]
+    lobby_name = lobby_owned_by("b")
+    a.team_dict[lobby_name] = {"turn": 7}
+
+    # b joins, a hands the lobby over but the handoff message is late
+    b.receive("servers/nodes/a", b"up")
+    a.receive("servers/nodes/b", b"up")
+    handoff = [message for message in network if message[0] == "servers/b/handoff"]
+    assert handoff and lobby_name not in a.team_dict
+    network.clear()
+
+    b.receive(f"games/{lobby_name}/p/move", b"UP")  # parked, b waits for the state
+    a.receive(f"games/{lobby_name}/p/move", b"DOWN")  # held by the handoff
+    time.sleep(2 * TIMEOUT)
+
+    a.run_tasks()  # the handoff expires, a keeps the lobby and tells everyone
+    assert a.team_dict[lobby_name] == {"turn": 7}
+    deliver(nodes, network)
+    b.run_tasks()
+
+    # The late handoff is ignored and new moves reaching b go to a
+    network.extend(handoff)
+    deliver(nodes, network)
+    b.receive(f"games/{lobby_name}/p/move", b"LEFT")
+    deliver(nodes, network)
+
+    assert lobby_name not in b.team_dict
+    assert b.dispatched == []
+    assert a.dispatched == [
+        (f"games/{lobby_name}/p/move", b"DOWN"),
+        (f"games/{lobby_name}/p/move", b"UP"),
+        (f"games/{lobby_name}/p/move", b"LEFT"),
+    ]
+
+
+def test_messages_for_a_lobby_that_never_arrives_are_not_dispatched():
+    network = []
+    b = Node("b", network)
+    b.receive("servers/nodes/a", b"up")
+    lobby_name = lobby_owned_by("b")
+
+    b.receive(f"games/{lobby_name}/p/move", b"UP")
+    time.sleep(2 * TIMEOUT)
+    b.run_tasks()
+
+    assert b.dispatched == []
+    assert b.directory.arriving == {}
@@ -0,0 +1,36 @@
+import json
+
+import paho.mqtt.client as paho
+
+from outbound import OutboundQueue
+from sharding import ShardRouter, shard_of
+
+
+class RecordingClient:
+    # Stands in for the paho client, nothing is ever acked
+    def __init__(self):
+        self.published = []
+        self.outbound = OutboundQueue(self)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload, qos))
+        info = paho.MQTTMessageInfo(len(self.published))
+        info.rc = paho.MQTT_ERR_SUCCESS
+        return info
+
+
+def test_forwarded_burst_is_not_lost():
+    router = ShardRouter(shard=0, num_shards=2)
+    client = RecordingClient()
+    lobbies = [f"lobby{i}" for i in range(400) if shard_of(f"lobby{i}", 2) == 1][:80]
+    payloads = [
+        json.dumps({"lobby_name": lobby_name, "team_name": "A", "player_name": "p"}).encode()
+        for lobby_name in lobbies
+    ]
+    for payload in payloads:
+        assert router.intercept(client, ["new_game"], payload)
+
+    assert [topic for topic, _, _ in client.published] == ["shards/1/new_game"] * len(payloads)
+    assert [payload for _, payload, _ in client.published] == payloads
+    assert all(qos == 1 for _, _, qos in client.published)
+    assert router.stats()["forwarded"] == len(payloads)
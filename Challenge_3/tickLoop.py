@@ -0,0 +1,69 @@
+import time
+import threading
+
+
+class TickLoop:
+    def __init__(self, rate: float, on_tick):
+        """
+        Calls on_tick at a fixed rate from its own thread, keeping to the original schedule
+        :param rate: ticks per second
+        :param on_tick: function run once per tick
+        """
+        self.period = 1 / rate
+        self.on_tick = on_tick
+        self.running = False
+        self.thread = None
+        self.ticks = 0
+        self.overruns = 0  # ticks whose work took longer than one period
+        self.skipped = 0  # ticks dropped to catch up after an overrun
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.work_max = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="tick-loop", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self) -> dict:
+        """
+        :return: tick counters with jitter and work times in milliseconds
+        """
+        return {
+            "rate": 1 / self.period,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter_mean_ms": 1000 * self.jitter_total / self.ticks if self.ticks else 0,
+            "jitter_max_ms": 1000 * self.jitter_max,
+            "work_max_ms": 1000 * self.work_max,
+        }
+
+    def __run(self):
+        scheduled = time.monotonic()
+        while self.running:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            started = time.monotonic()
+            jitter = started - scheduled
+            self.on_tick()
+            work = time.monotonic() - started
+
+            self.ticks += 1
+            self.jitter_total += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+            self.work_max = max(self.work_max, work)
+            if work > self.period:
+                self.overruns += 1
+
+            scheduled += self.period
+            behind = int((time.monotonic() - scheduled) / self.period)
+            if behind > 0:
+                # Running late, drop whole ticks rather than bursting to catch up
+                self.skipped += behind
+                scheduled += behind * self.period
@@ -0,0 +1,99 @@
+import math
+import time
+import threading
+
+
+class Timer:
+    __slots__ = ("expires", "callback", "bucket")
+
+    def __init__(self, expires: int, callback):
+        self.expires = expires
+        self.callback = callback
+        self.bucket = None
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 0.01, slot_bits: int = 8, levels: int = 3):
+        """
+        Hierarchical timing wheel, scheduling and cancelling are O(1) regardless of how many timers exist
+        :param tick: resolution of the innermost wheel in seconds
+        :param slot_bits: each wheel has 2**slot_bits slots
+        :param levels: number of wheels, each one covering 2**slot_bits times the span of the previous
+        """
+        self.tick = tick
+        self.bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.wheels: list[list[set]] = [[set() for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self.current = 0  # ticks elapsed since the wheel started
+        self.lock = threading.RLock()
+        self.thread = None
+        self.running = False
+
+    def schedule(self, delay: float, callback) -> Timer:
+        """
+        Runs callback on the wheel thread once delay seconds have passed
+        :return: handle that can be given to cancel
+        """
+        with self.lock:
+            timer = Timer(self.current + max(1, math.ceil(delay / self.tick)), callback)
+            self.__place(timer)
+            return timer
+
+    def cancel(self, timer: Timer):
+        with self.lock:
+            if timer.bucket is not None:
+                timer.bucket.discard(timer)
+                timer.bucket = None
+
+    def advance(self, ticks: int = 1):
+        """
+        Moves the wheel forward, cascading outer wheels down and firing expired timers
+        """
+        for _ in range(ticks):
+            with self.lock:
+                self.current += 1
+                self.__cascade(1)
+                bucket = self.wheels[0][self.current & self.mask]
+                expired = list(bucket)
+                bucket.clear()
+                for timer in expired:
+                    timer.bucket = None
+            for timer in expired:
+                timer.callback()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="timer-wheel", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def __place(self, timer: Timer):
+        delta = timer.expires - self.current
+        for level, wheel in enumerate(self.wheels):
+            if delta < 1 << (self.bits * (level + 1)) or level == len(self.wheels) - 1:
+                # Clamp beyond the outermost wheel, the timer is re-placed when that slot cascades
+                expires = min(timer.expires, self.current + (1 << (self.bits * (level + 1))) - 1)
+                timer.bucket = wheel[(expires >> (self.bits * level)) & self.mask]
+                timer.bucket.add(timer)
+                return
+
+    def __cascade(self, level: int):
+        if level >= len(self.wheels) or (self.current >> (self.bits * (level - 1))) & self.mask:
+            return
+        # The inner wheel wrapped around, the next outer slot is now within its range
+        self.__cascade(level + 1)
+        bucket = self.wheels[level][(self.current >> (self.bits * level)) & self.mask]
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            self.__place(timer)
+
+    def __run(self):
+        start = time.monotonic()
+        while self.running:
+            due = int((time.monotonic() - start) / self.tick)
+            if due > self.current:
+                self.advance(due - self.current)
+            time.sleep(self.tick)
@@ -0,0 +1,50 @@
+from timerWheel import TimerWheel
+
+
+class TurnScheduler:
+    def __init__(self, wheel: TimerWheel, deadline: float, on_deadline):
+        """
+        Keeps one turn deadline per lobby, all of them driven by a single timer wheel
+        :param wheel: shared timer wheel
+        :param deadline: seconds players have to submit their move
+        :param on_deadline: called as on_deadline(lobby_name, turn) from the wheel thread
+        """
+        self.wheel = wheel
+        self.deadline = deadline
+        self.on_deadline = on_deadline
+        self.timers = {}  # {'lobby_name' : Timer}
+        self.turns = {}  # {'lobby_name' : turn number}
+        self.expired = 0
+
+    def start_turn(self, lobby_name: str):
+        """
+        Starts the deadline of the lobby's next turn, replacing the previous one
+        """
+        self.cancel(lobby_name)
+        turn = self.turns.get(lobby_name, 0) + 1
+        self.turns[lobby_name] = turn
+        self.timers[lobby_name] = self.wheel.schedule(
+            self.deadline, lambda: self.__expire(lobby_name, turn)
+        )
+
+    def is_current(self, lobby_name: str, turn: int) -> bool:
+        """
+        :return: False if the turn was resolved or the lobby closed after the deadline fired
+        """
+        return self.turns.get(lobby_name) == turn
+
+    def cancel(self, lobby_name: str):
+        timer = self.timers.pop(lobby_name, None)
+        if timer is not None:
+            self.wheel.cancel(timer)
+
+    def remove_lobby(self, lobby_name: str):
+        self.cancel(lobby_name)
+        self.turns.pop(lobby_name, None)
+
+    def stats(self) -> dict:
+        return {"deadline": self.deadline, "lobbies": len(self.turns), "expired": self.expired}
+
+    def __expire(self, lobby_name: str, turn: int):
+        self.expired += 1
+        self.on_deadline(lobby_name, turn)
@@ -0,0 +1,62 @@
+"""
+64-bit Zobrist keys for game states, every (cell, item) pair and (team, score) pair gets a fixed
+random key and a state hashes to the xor of its keys, so a single change updates it in O(1).
+Players and teams are keyed by their index within the game, so every game shares the same keys
+and the cache is bounded by the board size instead of growing with every lobby ever hosted
+"""
+
+import hashlib
+from functools import lru_cache
+
+from player import Player
+from gameItems import Wall, Coin
+
+MASK = (1 << 64) - 1
+
+
+def splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+
+@lru_cache(maxsize=None)
+def zobristKey(kind: str, index: int) -> int:
+    """
+    Same key on every server and client, kinds are hashed with blake2b
+    since python's own hash() changes between processes
+    """
+    seed = int.from_bytes(hashlib.blake2b(kind.encode(), digest_size=8).digest(), 'big')
+    return splitmix64(seed ^ splitmix64(index))
+
+
+def itemKind(item: object, playerIndex: dict[str, int]):
+    if item is None:
+        return None
+    if isinstance(item, Player):
+        return f'player{playerIndex[item.name]}'
+    if isinstance(item, Wall):
+        return 'wall'
+    if isinstance(item, Coin):
+        return f'coin{item.value}'
+    return item.__class__.__name__
+
+
+def cellKey(loc: tuple[int, int], item: object, playerIndex: dict[str, int]) -> int:
+    """
+    :param playerIndex: index of each player within the game, {'player_name' : index}
+    """
+    kind = itemKind(item, playerIndex)
+    if kind is None:
+        return 0
+    return zobristKey(kind, (loc[0] << 16) | loc[1])
+
+
+def scoreKey(teamIndex: int, score: int) -> int:
+    return zobristKey(f'score{teamIndex}', score)
+
+
+def formatHash(value: int) -> str:
+    # Hex string, JSON numbers lose precision above 2**53 in most clients
+    return f'{value:016x}'